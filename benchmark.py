@@ -0,0 +1,186 @@
+# Benchmarks of the engine and render hot paths on fixed boards, runs with the SDL dummy drivers
+#   python benchmark.py --output baseline.json
+#   python benchmark.py --compare baseline.json
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse, json, platform, random, sys, time
+import pygame
+import main as game
+from includes.engine import Piece, DOWN, TICK_RATE, COLOR_CODES
+from includes.elements import Game, TetrisBlock, createElement
+
+def fillBoard(engine, fixture):
+  """
+    Fill the board of an engine with one of the fixed patterns (without any filled row)
+  """
+  rng = random.Random(0)
+  (width, height) = (engine.board.width, engine.board.height)
+  engine.board.reset()
+  if fixture == 'empty':
+    return
+  if fixture == 'nearTop':
+    rows = range(3, height)
+  else:
+    rows = range(height // 2, height)
+  for row in rows:
+    hole = rng.randrange(width)
+    for col in range(width):
+      if fixture == 'checkerboard' and (col + row) % 2 == 0:
+        continue
+      if col != hole:
+        engine.board.place(col, row, COLOR_CODES[rng.choice(['red', 'blue', 'green'])])
+
+def fillRows(engine, n):
+  """
+    Fill the n bottom rows of the board so that they can be cleared
+  """
+  for row in range(engine.board.height - n, engine.board.height):
+    for col in range(engine.board.width):
+      engine.board.place(col, row, COLOR_CODES['red'])
+
+def measure(fn, setup = None, number = 200, repeat = 5):
+  """
+    Median and best time of one call of fn in microseconds; setup runs before every call and is
+    not timed
+  """
+  runs = []
+  for _ in range(repeat):
+    total = 0
+    for _ in range(number):
+      if setup:
+        setup()
+      start = time.perf_counter()
+      fn()
+      total += time.perf_counter() - start
+    runs.append(total / number * 1e6)
+  runs.sort()
+  return {'median': runs[len(runs) // 2], 'min': runs[0]}
+
+def placeCurrent(engine):
+  """
+    Put an L shaped tetromino right above the fixed blocks so that it can move and rotate
+  """
+  top = engine.board.height
+  for row in range(engine.board.height):
+    if engine.board.rows[row + engine.board.hidden]:
+      top = row
+      break
+  engine.current = Piece('L', 'red', 5)
+  engine.current.moveTo(engine.current.shifted(0, max(top - 3, 2)), 0, max(top - 3, 2))
+
+def run():
+  results = {}
+  engine = game.engine
+  fixtures = ['empty', 'half', 'nearTop', 'checkerboard']
+
+  for fixture in fixtures:
+    fillBoard(engine, fixture)
+    placeCurrent(engine)
+    results['checkForRows/' + fixture] = measure(engine.board.fullRows, number = 2000)
+    results['collision.shift/' + fixture] = measure(
+      lambda: engine.fits(engine.current.shifted(1, 0)), number = 2000)
+    results['collision.rotate/' + fixture] = measure(
+      lambda: engine.fits(engine.current.rotated()), number = 2000)
+    results['ghost/' + fixture] = measure(engine.ghost, number = 2000)
+
+    snapshot = engine.snapshot()
+    results['snapshot/' + fixture] = measure(engine.snapshot, number = 2000)
+    results['restore/' + fixture] = measure(lambda: engine.restore(snapshot), number = 2000)
+    results['serialize/' + fixture] = measure(engine.serialize, number = 500)
+    for n in range(1, 5):
+      def setup():
+        engine.restore(snapshot)
+        fillRows(engine, n)
+      rows = list(range(engine.board.height - n, engine.board.height))
+
+      def clear():
+        engine.board.clearRows(rows)
+      results['clearRows.engine/%d/%s' % (n, fixture)] = measure(clear, setup, number = 100)
+
+      def setupRender():
+        setup()
+        clear()
+
+      def render():
+        Game.clearRows(engine.board, rows, game.batch, game.background)
+        game.batch.flush()
+      results['clearRows.render/%d/%s' % (n, fixture)] = measure(render, setupRender, number = 20)
+    engine.restore(snapshot)
+
+    # One pass of the main loop: a gravity step, the HUD and the display update
+    currentElement = createElement(engine.current)
+    def setupFrame():
+      engine.restore(snapshot)
+      engine.ticks += TICK_RATE
+      game.hud['time'] = None
+
+    def frame():
+      game.applyAction(DOWN, currentElement)
+      game.updateTime(game.GOLD, (35, 50))
+      game.batch.flush()
+      game.dirty.update()
+    results['frame/' + fixture] = measure(frame, setupFrame, number = 100)
+
+  results['TetrisBlock'] = measure(lambda: TetrisBlock('red', (0, 0)), number = 2000)
+  piece = Piece('T', 'blue', 3)
+  def nextElement():
+    game.displayNextElement(createElement(piece))
+    game.batch.flush()
+  results['displayNextElement'] = measure(nextElement)
+
+  scores = iter(range(10 ** 9))
+  results['updateScore'] = measure(lambda: game.updateScore(next(scores), 10 ** 6))
+
+  def setupTime():
+    engine.ticks += TICK_RATE
+  results['updateTime'] = measure(lambda: game.updateTime(game.GOLD, (35, 50)), setupTime)
+  return results
+
+def compare(results, baseline, threshold):
+  """
+    Print the change of every benchmark; returns the names of the ones that got slower than
+    the threshold allows
+  """
+  regressions = []
+  for (name, result) in sorted(results.items()):
+    if name not in baseline:
+      continue
+    ratio = result['median'] / baseline[name]['median']
+    flag = ''
+    if ratio > 1 + threshold:
+      flag = '  REGRESSION'
+      regressions.append(name)
+    print('%-40s %10.1f us %+7.1f%%%s' % (name, result['median'], (ratio - 1) * 100, flag))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Benchmark the engine and render hot paths')
+  parser.add_argument('--output', help = 'write the results to this JSON file')
+  parser.add_argument('--compare', help = 'JSON file of a previous run to compare against')
+  parser.add_argument('--threshold', type = float, default = 0.2,
+    help = 'relative slowdown that counts as a regression (default: 0.2)')
+  args = parser.parse_args()
+
+  report = {
+    'python': platform.python_version(),
+    'pygame': pygame.version.ver,
+    'machine': platform.machine(),
+    'results': run()
+  }
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent = 2)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)['results']
+    if compare(report['results'], baseline, args.threshold):
+      sys.exit(1)
+  elif not args.output:
+    print(json.dumps(report, indent = 2))
+
+if __name__ == '__main__':
+  main()
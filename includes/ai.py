@@ -0,0 +1,178 @@
+# Placement search: finds where the current tetromino should land, looking ahead at the next one
+# Boards are handled as tuples of row bitmasks (see includes/board.py) so no blocks are moved
+from collections import OrderedDict
+from includes.engine import SHAPES, ORIENTATIONS
+
+# Weights of the board features (aggregate height, cleared rows, holes, bumpiness)
+WEIGHTS = (-0.51, 0.76, -0.36, -0.18)
+
+# Only the best few placements of the current tetromino are searched with the next one
+BEAM = 6
+
+def normalized(squares):
+  minC = min(c for (c, _) in squares)
+  minR = min(r for (_, r) in squares)
+  return tuple(sorted((c - minC, r - minR) for (c, r) in squares))
+
+def orientations(shape):
+  """
+    Every distinct orientation of a shape as cells normalized to the top left corner
+  """
+  found = []
+  for squares in ORIENTATIONS[shape]:
+    cells = normalized(squares)
+    if cells not in found:
+      found.append(cells)
+  return found
+
+class Placement:
+  """
+    Precomputed data of one orientation: its cells, width, the lowest cell of every column and
+    the bitmask of every row (for column 0)
+  """
+  def __init__(self, index, cells):
+    self.index = index
+    self.cells = cells
+    self.width = max(c for (c, _) in cells) + 1
+    self.height = max(r for (_, r) in cells) + 1
+    self.bottom = [max(r for (c, r) in cells if c == i) for i in range(self.width)]
+    self.masks = [0] * self.height
+    for (c, r) in cells:
+      self.masks[r] |= 1 << c
+
+# Placement tables of every shape
+PLACEMENTS = {shape: [Placement(i, cells) for (i, cells) in enumerate(orientations(shape))]
+              for shape in SHAPES}
+
+class TranspositionTable:
+  """
+    Results keyed by board hash; the least recently used entries are evicted
+  """
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.entries = OrderedDict()
+
+  def get(self, key):
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      return self.entries[key]
+    return None
+
+  def put(self, key, value):
+    self.entries[key] = value
+    if len(self.entries) > self.capacity:
+      self.entries.popitem(last = False)
+
+class Planner:
+  """
+    Scores every reachable final placement of the current tetromino (and of the preview one)
+  """
+  def __init__(self, width = 12, height = 23, hidden = 4, capacity = 50000):
+    self.width = width
+    self.height = height
+    self.hidden = hidden
+    self.fullMask = (1 << width) - 1
+    self.evaluations = TranspositionTable(capacity)
+    self.plans = TranspositionTable(capacity // 10)
+
+  def tops(self, rows):
+    """
+      Index of the highest taken row in every column (len(rows) if the column is empty)
+    """
+    tops = [len(rows)] * self.width
+    seen = 0
+    for (i, row) in enumerate(rows):
+      new = row & ~seen
+      while new:
+        low = new & -new
+        tops[low.bit_length() - 1] = i
+        new ^= low
+      seen |= row
+      if seen == self.fullMask:
+        break
+    return tops
+
+  def drops(self, rows, shape, startRow):
+    """
+      Every placement of a shape dropped straight down from startRow
+      Yields the placement, its column and the rows of the board after the drop and line clears
+    """
+    tops = self.tops(rows)
+    for placement in PLACEMENTS[shape]:
+      for col in range(self.width - placement.width + 1):
+        y = min(tops[col + i] - placement.bottom[i] for i in range(placement.width)) - 1
+        if y < startRow:
+          continue
+        newRows = list(rows)
+        for (i, mask) in enumerate(placement.masks):
+          newRows[y + i] |= mask << col
+        cleared = 0
+        if any(newRows[y + i] == self.fullMask for i in range(placement.height)):
+          kept = [row for row in newRows if row != self.fullMask]
+          cleared = len(newRows) - len(kept)
+          newRows = [0] * cleared + kept
+        yield (placement, col, tuple(newRows), cleared)
+
+  def evaluate(self, rows, cleared):
+    """
+      Heuristic score of a board (higher is better)
+    """
+    key = (rows, cleared)
+    score = self.evaluations.get(key)
+    if score is not None:
+      return score
+
+    tops = self.tops(rows)
+    heights = [len(rows) - t for t in tops]
+    holes = 0
+    seen = 0
+    for row in rows:
+      holes += (seen & ~row).bit_count()
+      seen |= row
+    bumpiness = sum(abs(heights[i] - heights[i + 1]) for i in range(self.width - 1))
+    score = (WEIGHTS[0] * sum(heights) + WEIGHTS[1] * cleared + WEIGHTS[2] * holes +
+             WEIGHTS[3] * bumpiness)
+    self.evaluations.put(key, score)
+    return score
+
+  def best(self, rows, shape, nextShape = None, startRow = 0):
+    """
+      Best placement of a shape as (placement, column) or None if it cannot be placed
+      rows are the bitmasks of the board including its hidden rows; startRow is the top row (in
+      the same indexing) of the tetromino when it starts to fall
+    """
+    rows = tuple(rows)
+    key = (rows, shape, nextShape, startRow)
+    plan = self.plans.get(key)
+    if plan is not None:
+      return plan
+
+    candidates = []
+    for (placement, col, newRows, cleared) in self.drops(rows, shape, startRow):
+      candidates.append((self.evaluate(newRows, cleared), placement.index, col, newRows, cleared))
+    if not candidates:
+      return None
+    candidates.sort(key = lambda c: -c[0])
+
+    if nextShape is not None:
+      # Look ahead at the preview tetromino for the most promising placements only
+      searched = []
+      for (score, index, col, newRows, cleared) in candidates[:BEAM]:
+        follow = [self.evaluate(r, cleared + c) for (_, _, r, c) in
+                  self.drops(newRows, nextShape, self.hidden - 1)]
+        searched.append((max(follow) if follow else score - 1000, index, col))
+      searched.sort(key = lambda c: -c[0])
+      (_, index, col) = searched[0]
+    else:
+      (_, index, col, _, _) = candidates[0]
+
+    plan = (PLACEMENTS[shape][index], col)
+    self.plans.put(key, plan)
+    return plan
+
+  def plan(self, engine):
+    """
+      Best placement of the current tetromino of an engine
+    """
+    startRow = min(r for (_, r) in engine.current.squares) + engine.board.hidden
+    return self.best(engine.board.rows, engine.current.shape, engine.next.shape, startRow)
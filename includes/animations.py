@@ -0,0 +1,40 @@
+# Animations are generators that draw one frame each time they are advanced; the game loop
+# advances every running animation once per presented frame, so an effect that lasts for many
+# frames never holds up input handling or gravity
+# An animation that paints over cells of the map yields the list of those cells, so they can be
+# redrawn from the state of the game if it has to be stopped early
+
+class Animations:
+  """
+    The running animations, advanced in the order they were started
+  """
+  def __init__(self):
+    # [generator, cells it has painted over] pairs
+    self.running = []
+
+  def __len__(self):
+    return len(self.running)
+
+  def start(self, animation):
+    self.running.append([animation, []])
+
+  def step(self):
+    """
+      Draw the next frame of every animation and drop the finished ones
+    """
+    for entry in list(self.running):
+      try:
+        entry[1] = next(entry[0]) or []
+      except StopIteration:
+        self.running.remove(entry)
+
+  def cancel(self):
+    """
+      Stop every animation; returns the cells of the map they left painted over
+    """
+    cells = set()
+    for (animation, painted) in self.running:
+      animation.close()
+      cells.update(painted)
+    self.running = []
+    return cells
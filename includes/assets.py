@@ -0,0 +1,40 @@
+# Images and sounds are decoded on a pool of threads as soon as they are requested and kept for the
+# life of the process, so the window shows up without waiting for them and restarts load nothing
+import pygame
+from concurrent.futures import ThreadPoolExecutor
+
+SOUND_EXTENSIONS = ('.wav', '.ogg')
+
+class Assets:
+  """
+    Cache of decoded assets keyed by path; sounds need an initialized mixer and images need a
+    display when they are fetched (they are converted to its pixel format)
+  """
+  def __init__(self, workers = 4):
+    self.pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'assets')
+    self.pending = {}
+    self.images = {}
+
+  def request(self, path):
+    """
+      Start decoding a file in the background (once); returns its future
+    """
+    if path not in self.pending:
+      decode = pygame.mixer.Sound if path.lower().endswith(SOUND_EXTENSIONS) else pygame.image.load
+      self.pending[path] = self.pool.submit(decode, path)
+    return self.pending[path]
+
+  def preload(self, paths):
+    for path in paths:
+      self.request(path)
+
+  def image(self, path):
+    """
+      Decoded image converted for fast blitting; waits for the decoding if it is still running
+    """
+    if path not in self.images:
+      self.images[path] = self.request(path).result().convert()
+    return self.images[path]
+
+  def sound(self, path):
+    return self.request(path).result()
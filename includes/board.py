@@ -0,0 +1,174 @@
+# Grid model of the playfield: every row is stored as an integer bitmask so that collision
+# tests, full row detection and row compaction are constant time per cell, and the color of every
+# cell is kept in a flat byte array so that copying the board is a single memory copy
+# The highest taken cell of every column is kept up to date as well, so the distance a tetromino
+# can fall is a lookup per column
+from array import array
+from bisect import bisect_left
+
+class Board:
+  """
+    Playfield of width x height cells; column 0 is the left wall, row 0 is the top of the map
+    A few hidden rows above the map are kept so that freshly spawned tetrominos (which start
+    above the visible area) can also be stored and tested
+    Cells hold a small color code, 0 means an empty cell
+  """
+  __slots__ = ('width', 'height', 'hidden', 'fullMask', 'rows', 'grid', 'tops')
+
+  def __init__(self, width = 12, height = 23, hidden = 4):
+    self.width = width
+    self.height = height
+    self.hidden = hidden
+    self.fullMask = (1 << width) - 1
+    self.reset()
+
+  def reset(self):
+    """
+      Remove every block from the board
+    """
+    total = self.height + self.hidden
+    self.rows = [0] * total
+    self.grid = array('B', bytes(total * self.width))
+    # Index in rows of the highest taken cell of every column, len(rows) if the column is empty
+    self.tops = [total] * self.width
+
+  def inside(self, col, row):
+    return 0 <= col < self.width and -self.hidden <= row < self.height
+
+  def isOccupied(self, col, row):
+    """
+      Check if a cell is taken by a block; cells outside of the board are considered free
+    """
+    if not self.inside(col, row):
+      return False
+    return (self.rows[row + self.hidden] >> col) & 1 == 1
+
+  def collides(self, cells):
+    """
+      Check if any of the given (col, row) cells is already taken
+    """
+    for (col, row) in cells:
+      if self.isOccupied(col, row):
+        return True
+    return False
+
+  def place(self, col, row, code):
+    """
+      Mark a cell as taken by a block of the given color code
+    """
+    if not self.inside(col, row):
+      return
+    r = row + self.hidden
+    self.rows[r] |= 1 << col
+    self.grid[r * self.width + col] = code
+    if r < self.tops[col]:
+      self.tops[col] = r
+
+  def get(self, col, row):
+    """
+      Color code of a cell
+    """
+    return self.grid[(row + self.hidden) * self.width + col]
+
+  def row(self, row):
+    """
+      Color codes of a row as a copy
+    """
+    start = (row + self.hidden) * self.width
+    return self.grid[start:start + self.width]
+
+  def fullRows(self, rows = None):
+    """
+      Return the indices of the completely filled rows (top to bottom), only the given rows are
+      tested if there are any
+    """
+    if rows is None:
+      rows = range(-self.hidden, self.height)
+    return sorted(row for row in rows
+                  if self.inside(0, row) and self.rows[row + self.hidden] == self.fullMask)
+
+  def clearRows(self, rows):
+    """
+      Remove the given rows and let every row above them fall down
+      Rows are deleted from the byte grid in place, so the cost is a memory move per cleared row
+    """
+    width = self.width
+    removed = sorted(row + self.hidden for row in rows)
+    for r in reversed(removed):
+      del self.rows[r]
+      del self.grid[r * width:(r + 1) * width]
+    self.rows[0:0] = [0] * len(rows)
+    self.grid[0:0] = array('B', bytes(len(rows) * width))
+
+    # A column top falls by the number of removed rows below it; blocks only fall, so the
+    # columns whose top was removed are searched downwards from where it was
+    for col in range(width):
+      top = self.tops[col]
+      i = bisect_left(removed, top)
+      if i < len(removed) and removed[i] == top:
+        self.tops[col] = self.columnTop(col, top)
+      else:
+        self.tops[col] = top + len(removed) - i
+
+  def insertRows(self, n, hole, code):
+    """
+      Push every row up by n and fill the n bottom rows except for the hole column
+      Returns False if blocks were pushed out of the top of the board
+    """
+    overflow = any(self.rows[:n])
+    mask = self.fullMask & ~(1 << hole)
+    self.rows = self.rows[n:] + [mask] * n
+    row = array('B', [0 if col == hole else code for col in range(self.width)])
+    self.grid = self.grid[n * self.width:] + row * n
+    if overflow:
+      self.tops = [self.columnTop(col) for col in range(self.width)]
+    else:
+      total = len(self.rows)
+      self.tops = [total if top == total and col == hole else top - n
+                   for (col, top) in enumerate(self.tops)]
+    return not overflow
+
+  def copy(self):
+    """
+      State of the board as (row bitmasks, color codes); see restore
+    """
+    return (list(self.rows), self.grid.tobytes())
+
+  def restore(self, state):
+    (rows, grid) = state
+    self.rows = list(rows)
+    self.grid = array('B', grid)
+    self.tops = [self.columnTop(col) for col in range(self.width)]
+
+  def columnTop(self, col, start = 0):
+    """
+      Index in rows of the highest taken cell of a column at or below start
+    """
+    bit = 1 << col
+    for r in range(start, len(self.rows)):
+      if self.rows[r] & bit:
+        return r
+    return len(self.rows)
+
+  def dropDistance(self, cells):
+    """
+      How many rows the given cells can fall before they hit a block or the bottom of the map
+      The column tops answer it unless a cell is below the top of its column (under an overhang),
+      then the rows below the cells are tested one by one
+    """
+    distance = self.height + self.hidden
+    for (col, row) in cells:
+      r = row + self.hidden
+      if r > self.tops[col]:
+        return self.scanDistance(cells)
+      distance = min(distance, self.tops[col] - r - 1)
+    return distance
+
+  def scanDistance(self, cells):
+    distance = 0
+    while True:
+      for (col, row) in cells:
+        r = row + self.hidden + distance + 1
+        if r >= len(self.rows) or (r >= 0 and (self.rows[r] >> col) & 1):
+          return distance
+      distance += 1
@@ -0,0 +1,74 @@
+# Automated players; a policy gets the engine and a random generator at every logic tick and
+# returns the action to apply (or None to let the tetromino fall)
+import importlib
+from includes.engine import LEFT, RIGHT, ROTATE, SOFT_DROP
+from includes.ai import Planner, normalized
+
+def idleBot(engine, rng):
+  """
+    Never touches the keyboard
+  """
+  return None
+
+def randomBot(engine, rng):
+  """
+    Presses a random key about 5 times per second
+  """
+  if rng.random() < 0.1:
+    return rng.choice([LEFT, RIGHT, ROTATE, SOFT_DROP])
+  return None
+
+class PlannerBot:
+  """
+    Steers every tetromino to the placement chosen by the planner: rotate, shift, then drop
+  """
+  def __init__(self):
+    self.planner = Planner()
+    self.engine = None
+    self.piece = None
+
+  def __call__(self, engine, rng):
+    if engine is not self.engine or engine.pieces != self.piece:
+      board = engine.board
+      if (self.planner.width, self.planner.height) != (board.width, board.height):
+        self.planner = Planner(board.width, board.height, board.hidden)
+      self.engine = engine
+      self.piece = engine.pieces
+      self.target = self.planner.plan(engine)
+      self.rotations = 0
+
+    if self.target is None:
+      return SOFT_DROP
+    (placement, col) = self.target
+    squares = engine.current.squares
+
+    # Rotations are not allowed at the top of the map, let the tetromino fall a bit first
+    if normalized(squares) != placement.cells and self.rotations < 4:
+      if min(r for (_, r) in squares) <= 0:
+        return SOFT_DROP
+      self.rotations += 1
+      return ROTATE
+
+    left = min(c for (c, _) in squares)
+    if left > col:
+      return LEFT
+    if left < col:
+      return RIGHT
+    return SOFT_DROP
+
+BOTS = {
+  'idle': idleBot,
+  'random': randomBot,
+  'planner': PlannerBot()
+}
+
+def loadBot(name):
+  """
+    Find a policy by its name in BOTS or as 'package.module:function'
+  """
+  if name in BOTS:
+    return BOTS[name]
+  if ':' not in name:
+    raise ValueError('Unknown bot: ' + name)
+  (moduleName, funcName) = name.split(':')
+  return getattr(importlib.import_module(moduleName), funcName)
@@ -0,0 +1,117 @@
+# Recording of the presented frames: the game thread only copies the regions of the screen that
+# changed, straight out of the pixel buffer of the surface, and a background thread patches them
+# into its own copy of the screen and writes every frame out
+# When the writer falls behind, frames are dropped (and counted) instead of slowing the game; the
+# frame after a drop is copied in full so the recording never shows stale regions
+import os, queue, subprocess, sys, threading
+import pygame
+
+class FrameCapture:
+  """
+    target is where the frames go:
+      a directory: one PNG file per frame (frame-000001.png, ..., numbered by the presented frames
+      so dropped ones leave gaps)
+      '|command': raw frames are piped into the command (e.g. ffmpeg)
+      any other path: raw frames are appended to that file
+    Raw frames have the pixel format of the screen (4 bytes per pixel, see the masks of the
+    display surface), row after row
+  """
+  def __init__(self, screen, target, capacity = 120):
+    self.screen = screen
+    self.target = target
+    self.presented = 0
+    self.frames = 0
+    self.dropped = 0
+    self.full = True
+    self.queue = queue.Queue(maxsize = capacity)
+    # The copy of the screen the regions are patched into
+    self.canvas = pygame.Surface(screen.get_size(), 0, screen)
+    self.pipe = None
+    if target.startswith('|'):
+      self.pipe = subprocess.Popen(target[1:], shell = True, stdin = subprocess.PIPE)
+      self.out = self.pipe.stdin
+    elif os.path.isdir(target):
+      self.out = None
+    else:
+      self.out = open(target, 'wb')
+    self.thread = threading.Thread(target = self.writer, daemon = True)
+    self.thread.start()
+
+  def frame(self, rects = None):
+    """
+      Capture the frame that has just been presented; rects are the regions that changed since the
+      previous one, None if the whole screen did
+    """
+    self.presented += 1
+    bounds = self.screen.get_rect()
+    if self.full or rects is None:
+      rects = [bounds]
+    else:
+      rects = [r for r in (bounds.clip(rect) for rect in rects) if r.w and r.h]
+
+    pitch = self.screen.get_pitch()
+    size = self.screen.get_bytesize()
+    patches = []
+    # The screen stays locked while its buffer is referenced
+    buffer = self.screen.get_buffer()
+    view = memoryview(buffer)
+    try:
+      for rect in rects:
+        start = rect.y * pitch + rect.x * size
+        width = rect.w * size
+        if width == pitch:
+          data = view[start:start + rect.h * pitch].tobytes()
+        else:
+          data = b''.join(view[offset:offset + width]
+                          for offset in range(start, start + rect.h * pitch, pitch))
+        patches.append((rect, data))
+    finally:
+      view.release()
+      del view, buffer
+
+    try:
+      self.queue.put_nowait((self.presented, patches))
+      self.full = False
+    except queue.Full:
+      self.dropped += 1
+      self.full = True
+
+  def writer(self):
+    pitch = self.canvas.get_pitch()
+    size = self.canvas.get_bytesize()
+    while True:
+      item = self.queue.get()
+      if item is None:
+        return
+      (number, patches) = item
+      buffer = self.canvas.get_buffer()
+      for (rect, data) in patches:
+        width = rect.w * size
+        for row in range(rect.h):
+          buffer.write(data[row * width:(row + 1) * width], (rect.y + row) * pitch + rect.x * size)
+      del buffer
+
+      self.frames += 1
+      if self.out is None:
+        pygame.image.save(self.canvas, os.path.join(self.target, 'frame-%06d.png' % number))
+      else:
+        try:
+          self.out.write(self.canvas.get_buffer().raw)
+        except BrokenPipeError:
+          # The encoder went away, the remaining frames are thrown away
+          self.out = open(os.devnull, 'wb')
+
+  def close(self):
+    """
+      Write the queued frames and stop the writer
+    """
+    self.queue.put(None)
+    self.thread.join()
+    if self.out is not None:
+      self.out.close()
+    if self.pipe is not None:
+      self.pipe.wait()
+
+  def report(self):
+    print('captured %d frames to %s, %d dropped' % (self.frames, self.target, self.dropped),
+          file = sys.stderr)
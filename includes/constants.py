@@ -1,10 +1,18 @@
 # Constant variables that are used throughout the game
-import pygame.freetype
+import os
 
-pygame.init()
+# Size of the map in cells (TETRIS_WIDTH x TETRIS_HEIGHT) and of a cell in pixels (TETRIS_CELL)
+BOARD_SIZE = int(os.environ.get('TETRIS_WIDTH', 12)), int(os.environ.get('TETRIS_HEIGHT', 23))
+CELL_SIZE = int(os.environ.get('TETRIS_CELL', 25))
 
-SCREEN_SIZE = 600, 575
+# Width of the HUD at the left and of the preview at the right of the map
+PANEL_WIDTH = 150
+MAP_RECT = PANEL_WIDTH, 0, BOARD_SIZE[0] * CELL_SIZE, BOARD_SIZE[1] * CELL_SIZE
+MAP_RIGHT = PANEL_WIDTH + MAP_RECT[2]
+SCREEN_SIZE = 2 * PANEL_WIDTH + MAP_RECT[2], max(MAP_RECT[3], 575)
 WHITE = 255, 255, 255
 BLACK = 0, 0, 0
 GOLD = 255, 215, 0
-GAME_FONT = pygame.freetype.Font('fonts/classic.ttf', 14)
+GRID = 155, 173, 183
+# Cap of the presented frames per second (TETRIS_FPS), 0 presents a frame on every pass of the loop
+FPS = int(os.environ.get('TETRIS_FPS', 60))
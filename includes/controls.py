@@ -0,0 +1,163 @@
+# Keyboard input of the game: SDL only queues the events that are handled, held arrows repeat with
+# delayed auto-shift (DAS) and an auto-repeat rate (ARR), and a rotation refused at the top of the
+# map is buffered for a few logic ticks instead of being lost
+# Times are counted in logic ticks
+import time
+from collections import deque
+import pygame
+from includes.engine import LEFT, RIGHT, ROTATE, HARD_DROP
+
+KEYS = {
+  pygame.K_LEFT: LEFT,
+  pygame.K_RIGHT: RIGHT,
+  pygame.K_UP: ROTATE,
+  pygame.K_SPACE: HARD_DROP
+}
+
+# Column step of the arrows
+SHIFTS = {LEFT: -1, RIGHT: 1}
+
+# Events after which the window has to be pushed to the display again as a whole: only the dirty
+# regions are updated otherwise, so an exposed or restored window would keep stale pixels
+REDRAW_EVENTS = [pygame.VIDEOEXPOSE, pygame.WINDOWEVENT]
+
+def allowEvents():
+  """
+    Let only the events the game reacts to into the queue (needs an initialized display)
+  """
+  pygame.event.set_blocked(None)
+  pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP] + REDRAW_EVENTS)
+
+class Press:
+  __slots__ = ('action', 'readAt', 'ticksLeft', 'piece', 'toWall')
+
+  def __init__(self, action, readAt, ticksLeft, piece = None, toWall = False):
+    self.action = action
+    # Auto repeat with ARR 0: the move is repeated for as long as the tetromino can go on
+    self.toWall = toWall
+    # When the event was taken from the queue, None for auto repeats
+    self.readAt = readAt
+    self.ticksLeft = ticksLeft
+    self.piece = piece
+
+class Controls:
+  """
+    das: ticks an arrow has to be held before it starts repeating
+    arr: ticks between two repeats (0 moves the tetromino to the wall at once)
+    bufferTicks: how long a rotation refused at the top of the map is retried
+    measure: collect the time from reading a key event to presenting its first frame, for the
+    last `window` presses
+  """
+  def __init__(self, das = 10, arr = 2, bufferTicks = 20, measure = False, window = 10000):
+    self.das = das
+    self.arr = arr
+    self.bufferTicks = bufferTicks
+    self.measure = measure
+    self.latencies = deque(maxlen = window)
+    # Presses measured since the start, including the ones that left the window
+    self.measured = 0
+    self.reset()
+
+  def reset(self):
+    self.softDrop = False
+    # Arrows that are held down, the last pressed one moves the tetromino
+    self.held = []
+    self.heldTicks = 0
+    self.pressed = []
+    self.buffered = []
+    self.unpresented = []
+
+  def read(self, event):
+    """
+      Handle a keyboard event; returns False if it is not one of the game controls
+    """
+    if event.type == pygame.KEYDOWN:
+      if event.key == pygame.K_DOWN:
+        self.softDrop = True
+      elif event.key in KEYS:
+        action = KEYS[event.key]
+        # A new press replaces the one that is waiting to be retried
+        self.buffered = []
+        self.pressed.append(Press(action, time.perf_counter(), self.bufferTicks))
+        if action in (LEFT, RIGHT):
+          if action in self.held:
+            self.held.remove(action)
+          self.held.append(action)
+          self.heldTicks = 0
+      else:
+        return False
+    elif event.type == pygame.KEYUP:
+      if event.key == pygame.K_DOWN:
+        self.softDrop = False
+      elif event.key in KEYS and KEYS[event.key] in self.held:
+        self.held.remove(KEYS[event.key])
+        self.heldTicks = 0
+      else:
+        return False
+    else:
+      return False
+    return True
+
+  def poll(self, ticks, piece):
+    """
+      Presses to apply now: the buffered ones that are still valid for the current tetromino,
+      the new ones and the auto repeats of the held arrow for every logic tick that is due
+      With ARR 0 a held arrow gives one toWall press per tick, the caller repeats it until the
+      move is refused
+    """
+    presses = []
+    for press in self.buffered:
+      press.ticksLeft -= ticks
+      if press.ticksLeft > 0 and press.piece == piece:
+        presses.append(press)
+    presses += self.pressed
+    self.buffered = []
+    self.pressed = []
+
+    if self.held:
+      action = self.held[-1]
+      for _ in range(ticks):
+        self.heldTicks += 1
+        if self.heldTicks < self.das:
+          continue
+        if self.arr == 0:
+          presses.append(Press(action, None, 0, toWall = True))
+        elif (self.heldTicks - self.das) % self.arr == 0:
+          presses.append(Press(action, None, 0))
+    return presses
+
+  def applied(self, press, result, piece, atTop):
+    """
+      Report the outcome of a press; a rotation that was refused because the tetromino is at the
+      top of the map (atTop) is retried at the next polls, other presses that did nothing are
+      dropped so the tetromino never moves on its own later
+    """
+    if result.moved or result.locked:
+      if self.measure and press.readAt is not None:
+        self.unpresented.append(press.readAt)
+    elif press.action == ROTATE and atTop and press.ticksLeft > 0:
+      press.piece = piece
+      self.buffered.append(press)
+
+  def presented(self):
+    """
+      Called right after a frame has been pushed to the display
+    """
+    if self.unpresented:
+      now = time.perf_counter()
+      self.latencies.extend(now - readAt for readAt in self.unpresented)
+      self.measured += len(self.unpresented)
+      self.unpresented = []
+
+  def report(self):
+    """
+      Percentiles of the measured input latency in milliseconds
+    """
+    if not self.latencies:
+      return {}
+    ordered = sorted(self.latencies)
+    report = {'count': self.measured, 'window': len(ordered)}
+    for p in (0.5, 0.95, 0.99):
+      report['p%d' % (p * 100)] = ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+    report['max'] = ordered[-1] * 1000
+    return report
@@ -1,284 +1,192 @@
-import pygame, random, copy
+import pygame
 from includes.constants import *
-from includes.helpers import * 
+from includes.helpers import *
+from includes.engine import PALETTE
+
+# The rules of the game are kept by includes/engine.py, this module only draws its state
 
 class Game:
-  # Represents all the tetris blocks that are visible on the map
-  tetrominos = []
-  
   @staticmethod
-  def checkForRows():
-    """
-      Check for filled rows
-    """
-    filledRowPos = []
-    elementsPos = [(sq.pos[0], sq.pos[1]) for sq in Game.tetrominos]
-    for i in range(24):
-      flag = True
-      for j in range(12):
-        rPos = (150 + j * 25, i * 25)
-        if rPos not in elementsPos:
-          flag = False
-      if flag:
-        filledRowPos.append(i * 25)
-
-    return filledRowPos
+  def mapBackground(image):
+    """
+      Background of the map: the image if it was drawn for this board size, otherwise a grid
+      of CELL_SIZE px cells is drawn in the same style
+    """
+    (width, height) = MAP_RECT[2:]
+    if image.get_size() == (width, height):
+      return image
+    surface = pygame.Surface((width, height)).convert()
+    surface.fill(BLACK)
+    for x in list(range(0, width, CELL_SIZE)) + [width - 1]:
+      pygame.draw.line(surface, GRID, (x, 0), (x, height - 1))
+    for y in list(range(0, height, CELL_SIZE)) + [height - 1]:
+      pygame.draw.line(surface, GRID, (0, y), (width - 1, y))
+    return surface
 
   @staticmethod
-  def clearRow(posYs, screen, background):
+  def eraseCell(cell, batch, background):
     """
-      If the row is completely filled then clear it 
+      Draw the background of the map over a cell
     """
-    localTetrominos = Game.tetrominos.copy()
-    toRemove = []
-    for sq in Game.tetrominos:
-      if sq.pos[1] in posYs:
-        localTetrominos.remove(sq)
-        screen.blit(background, sq.pos, (150, 0, 26, 26))
-
-    Game.tetrominos = localTetrominos
+    area = (cell[0] * CELL_SIZE, cell[1] * CELL_SIZE, CELL_SIZE, CELL_SIZE)
+    batch.blit(background, cellPos(cell), area)
 
   @staticmethod
-  def shiftRows(posYs, screen, background):
-    """
-      If a row has been cleared shift every block down by 1
-    """
-    verticalShift = len(posYs)
-    for sq in Game.tetrominos:
-      if sq.pos[1] < max(posYs):
-        screen.blit(background, sq.pos, (150, 0, 26, 26))
-
-    for sq in Game.tetrominos:
-      if sq.pos[1] < max(posYs):
-        for i in range(verticalShift):
-          sq.move()
-        screen.blit(sq.image, sq.pos)
-
-class TetrisBlock:
-  """
-    Builds 1 square block; more of these can be grouped together to form an L, Z, etc. shaped
-    element
-    Each square has its own velocity, position and image source
-  """
-  def __init__(self, color, pos, pivotPoint):
-    self.size = 24
-    self.image = pygame.image.load('sprites/' + color + 'Block.png').convert()
-    self.pos = self.image.get_rect().move(pos)
-    self.speed = 25
-    self.pivotPoint = pivotPoint
+  def clearRows(board, rows, batch, background):
+    """
+      Rows have been cleared by the engine: the part of the map above every cleared row is
+      scrolled down by one row on the screen, so the cost does not depend on the number of blocks
+    """
+    batch.flush()
+    screen = batch.target
+    (left, _, width, height) = MAP_RECT
+    # The top of the stack can be in the hidden rows above the map
+    top = board.height
+    for row in range(-board.hidden, board.height):
+      if board.rows[row + board.hidden]:
+        top = row
+        break
+    # The cleared rows were taken from above the current top of the stack
+    fromHidden = top < len(rows)
+    top = max(top - len(rows), 0)
+    batch.dirty.add((left, top * CELL_SIZE, width, height - top * CELL_SIZE))
+    for row in sorted(rows):
+      screen.set_clip((left, top * CELL_SIZE, width, (row + 1 - top) * CELL_SIZE))
+      screen.scroll(0, CELL_SIZE)
+      screen.blit(background, (left, top * CELL_SIZE), (0, top * CELL_SIZE, width, CELL_SIZE))
+      top += 1
+    screen.set_clip(None)
+    # The border line at the bottom of the map is not part of the row above it
+    screen.blit(background, (left, height - 1), (0, height - 1, width, 1))
+
+    # Blocks of the hidden rows fell into the top rows, which the scroll filled with background
+    if fromHidden:
+      for row in range(min(len(rows), board.height)):
+        for col in range(board.width):
+          code = board.get(col, row)
+          if code:
+            batch.blit(SpriteAtlas.surface, cellPos((col, row)), SpriteAtlas.areas[code - 1])
+
+class SpriteAtlas:
+  """
+    Every block sprite is decoded only once and packed side by side into a single surface
+    Blocks refer to their sprite by its index in the atlas
+    A second row holds the dimmed sprites of the ghost piece in the same order
+  """
+  # The index of a sprite is the color code of the board - 1
+  colors = PALETTE
+  size = CELL_SIZE - 1
+  surface = None
+  areas = []
+  ghosts = []
 
-  def move(self):
-    """
-      Vertical movemenet of a tetris block by 1 unit at a time
-    """
-    if not(self.pos.top + self.size >= SCREEN_SIZE[1]):
-      self.pos = self.pos.move(0, self.speed)
-
-      # Also update the pivot point of the element
-      px = self.pivotPoint[0]
-      py = self.pivotPoint[1]
-      self.pivotPoint = (px, py + self.speed)
-
-  def moveHorizontally(self, d):
-    """
-      Move the current tetris element left/right by 1 unit (if not already at the sides)
-    """
-    if d == 'l':
-      xShift = -(self.speed)
-    else:
-      xShift = self.speed
-
-    self.pos = self.pos.move(xShift, 0)
+  @staticmethod
+  def paths():
+    return ['sprites/' + color + 'Block.png' for color in SpriteAtlas.colors]
 
-    # Also update the pivot point of the element
-    px = self.pivotPoint[0]
-    py = self.pivotPoint[1]
-    self.pivotPoint = (px + xShift, py)
+  @staticmethod
+  def load(assets):
+    """
+      Build the atlas from the decoded sprites (needs an initialized display)
+    """
+    if SpriteAtlas.surface is not None:
+      return
+    size = SpriteAtlas.size
+    surface = pygame.Surface((size * len(SpriteAtlas.colors), 2 * size)).convert()
+    surface.fill(BLACK)
+    for (i, path) in enumerate(SpriteAtlas.paths()):
+      image = assets.image(path)
+      if image.get_size() != (size, size):
+        image = pygame.transform.smoothscale(image, (size, size))
+      surface.blit(image, (i * size, 0))
+      SpriteAtlas.areas.append((i * size, 0, size, size))
+      ghost = image.copy()
+      ghost.set_alpha(70)
+      surface.blit(ghost, (i * size, size))
+      SpriteAtlas.ghosts.append((i * size, size, size, size))
+    SpriteAtlas.surface = surface
 
-  def rotate(self):
-    """
-      Rotate an square around a pivot point (center of bounding box)
-      Also make sure that the rotation does not place the element out of the map
-    """
-    # Perform simple rotation by 90 deg
-    xOld = self.pos.left
-    self.pos.left = self.pos.top + self.pivotPoint[0] - self.pivotPoint[1]
-    self.pos.top = self.pivotPoint[0] + self.pivotPoint[1] - xOld - self.size
+  @staticmethod
+  def index(color):
+    return SpriteAtlas.colors.index(color)
 
-def randomXCoord(elementType):
+class DirtyRegions:
   """
-    Generate a random X coordinate for the first square block of a tetris element
+    Collects the regions of the screen that changed during a frame so that only those have to
+    be pushed to the display (and copied by the frame capture, if there is one)
   """
-  if elementType == 'L' or elementType == 'square':
-    return random.randrange(150, 400, 25)
-  elif elementType == 'I':
-    return random.randrange(150, 325, 25)
-  elif elementType == 'Z' or elementType == 'T':
-    return random.randrange(150, 350, 25)
+  def __init__(self, capture = None):
+    self.rects = []
+    self.full = False
+    self.capture = capture
 
-class TetrominoMethods:
-  def __init__(self, color, elementType):
-    self.isFixed = False
-    self.color = color
-    self.elementType = elementType
+  def add(self, rect):
+    self.rects.append(pygame.Rect(rect))
 
-  def didCollide(self):
+  def addAll(self):
     """
-      Check if the current tetromino has reached the bottom of the map or the top of another
-      tetromino
-      If yes, then do not move it further down
+      The whole screen changed, the next update will be a full flip
     """
-    # Check if the bottom of the map is reached
-    for sq in self.squares:
-      if sq.pos.bottom >= SCREEN_SIZE[1] - sq.size:
-        self.isFixed = True
-        return True
+    self.full = True
 
-    # Check if the top of another tetromino is reached
-    return checkCollision(self.squares, Game.tetrominos.copy(), 0, 25)
+  def update(self):
+    if self.full:
+      pygame.display.update()
+    elif self.rects:
+      pygame.display.update(self.rects)
+    if self.capture:
+      self.capture.frame(None if self.full else self.rects)
+    self.rects = []
+    self.full = False
 
-class LShapedElement(TetrominoMethods):
+class BlitBatch:
   """
-    An L-shaped tetris element that is made up of 1x1 squares; represented as an array
+    Collects the blits of a frame so that they can be drawn with a single Surface.blits call
+    Blits are drawn in the order they were added and their regions are marked as dirty
   """
-  def __init__(self, color, ex = True):
-    """
-      |1|
-      |2|
-      |3|4|
-    """
-    # Also, randomly select the x coordinate when creating a new element
-    super().__init__(color, 'L')
-    xCoord = randomXCoord('L')
-    pp = (xCoord + 37, 12)
-    self.squares = [TetrisBlock(color, (xCoord, -25), pp),
-                    TetrisBlock(color, (xCoord, 0), pp),
-                    TetrisBlock(color, (xCoord, 25), pp),
-                    TetrisBlock(color, (xCoord + 25, 25), pp)] 
-    if ex: Game.tetrominos.extend(self.squares)                    
+  def __init__(self, target, dirty):
+    self.target = target
+    self.dirty = dirty
+    self.queue = []
 
-class LShapedElementInv(TetrominoMethods):
-  """
-    An L-shaped tetris element that is made up of 1x1 squares; represented as an array
-  """
-  def __init__(self, color, ex = True):
-    """
-        |4|
-        |3|
-      |1|2|
-    """
-    # Also, randomly select the x coordinate when creating a new element
-    super().__init__(color, 'LInv')
-    xCoord = randomXCoord('L')
-    pp = (xCoord + 37, 12)
-    self.squares = [TetrisBlock(color, (xCoord, 25), pp),
-                    TetrisBlock(color, (xCoord + 25, 25), pp),
-                    TetrisBlock(color, (xCoord + 25, 0), pp),
-                    TetrisBlock(color, (xCoord + 25, -25), pp)] 
-    if ex: Game.tetrominos.extend(self.squares)                    
+  def blit(self, source, dest, area = None):
+    if area is None:
+      self.queue.append((source, dest))
+      self.dirty.add((dest[0], dest[1], source.get_width(), source.get_height()))
+    else:
+      self.queue.append((source, dest, area))
+      self.dirty.add((dest[0], dest[1], area[2], area[3]))
 
-class IShapedElement(TetrominoMethods):
-  """
-    An I-shaped tetris element that is made up of 1x1 squares
-  """
-  def __init__(self, color, ex = True):
-    """
-      |1|2|3|4|
-    """
-    super().__init__(color, 'I')
-    xCoord = randomXCoord('I')
-    pp = (xCoord + 50, -0.5)
-    self.squares = []
-    for i in range(4):
-      self.squares.append(TetrisBlock(color, (xCoord + i * 25, -25), pp))
-    if ex: Game.tetrominos.extend(self.squares)                    
+  def flush(self):
+    if self.queue:
+      self.target.blits(self.queue, doreturn = False)
+      self.queue = []
 
-class BigSquareElement(TetrominoMethods):
+class TetrisBlock:
   """
-    A 2x2 square tetris element that is made up of 1x1 squares
+    Builds 1 square block; more of these can be grouped together to form an L, Z, etc. shaped
+    element
+    Each square has its own position and the index of its sprite in the atlas
   """
-  def __init__(self, color, ex = True):
-    """
-      |1|2|
-      |3|4|
-    """
-    super().__init__(color, 'square')
-    xCoord = randomXCoord('square')
-    pp = (xCoord + 25, -0.5)
-    self.squares = [TetrisBlock(color, (xCoord, -25), pp),
-                    TetrisBlock(color, (xCoord + 25, -25), pp),
-                    TetrisBlock(color, (xCoord, 0), pp),
-                    TetrisBlock(color, (xCoord + 25, 0), pp)] 
-    if ex: Game.tetrominos.extend(self.squares)                    
+  __slots__ = ('index', 'cell', 'pos')
+  size = SpriteAtlas.size
 
-class ZShapedElement(TetrominoMethods):
-  """
-    A Z-shaped tetris element that is made up of 1x1 squares
-  """
-  def __init__(self, color, ex = True):
-    """
-      |1|2|
-        |3|4|
-    """
-    super().__init__(color, 'Z')
-    xCoord = randomXCoord('Z')
-    pp = (xCoord + 37, 12)
-    self.squares = [TetrisBlock(color, (xCoord, -25), pp),
-                    TetrisBlock(color, (xCoord + 25, -25), pp),
-                    TetrisBlock(color, (xCoord + 25, 0), pp),
-                    TetrisBlock(color, (xCoord + 50, 0), pp)]
-    if ex: Game.tetrominos.extend(self.squares)                    
+  def __init__(self, color, cell):
+    self.index = SpriteAtlas.index(color)
+    self.moveTo(cell)
 
-class ZShapedElementInv(TetrominoMethods):
-  """
-    A Z-shaped tetris element that is made up of 1x1 squares
-  """
-  def __init__(self, color, ex = True):
+  def moveTo(self, cell):
     """
-        |3|4|
-      |1|2|
+      Place the block on the given (col, row) cell of the map
     """
-    super().__init__(color, 'ZInv')
-    xCoord = randomXCoord('Z')
-    pp = (xCoord + 37, 12)
-    self.squares = [TetrisBlock(color, (xCoord, 0), pp),
-                    TetrisBlock(color, (xCoord + 25, 0), pp),
-                    TetrisBlock(color, (xCoord + 25, -25), pp),
-                    TetrisBlock(color, (xCoord + 50, -25), pp)]
-    if ex: Game.tetrominos.extend(self.squares)                    
+    self.cell = cell
+    self.pos = pygame.Rect(cellPos(cell), (self.size, self.size))
 
-class TShapedElement(TetrominoMethods):
-  """
-    A Z-shaped tetris element that is made up of 1x1 squares
-  """
-  def __init__(self, color, ex = True):
-    """
-      |1|2|3|
-        |4|
-    """
-    super().__init__(color, 'T')
-    xCoord = randomXCoord('T')
-    pp = (xCoord + 37, 12)
-    self.squares = [TetrisBlock(color, (xCoord, -25), pp),
-                    TetrisBlock(color, (xCoord + 25, -25), pp),
-                    TetrisBlock(color, (xCoord + 50, -25), pp),
-                    TetrisBlock(color, (xCoord + 25, 0), pp)]
-    if ex: Game.tetrominos.extend(self.squares)                    
+  def draw(self, target):
+    target.blit(SpriteAtlas.surface, self.pos, SpriteAtlas.areas[self.index])
 
-def selectRandomElement(extra = False):
+def createElement(piece):
   """
-    Select a tetris element with a random color and shape
-    Also return the color and shape on request
+    Build the sprites of a tetromino of the engine
   """
-  color = random.choice(['red', 'cyan', 'yellow', 'orange', 'green', 'blue'])
-  shape = random.choice([LShapedElement,
-                         LShapedElementInv,
-                         IShapedElement,
-                         BigSquareElement,
-                         ZShapedElement,
-                         ZShapedElementInv,
-                         TShapedElement
-                       ])
-  if extra:
-    return [shape, color]
-  return shape(color)
+  return [TetrisBlock(piece.color, cell) for cell in piece.squares]
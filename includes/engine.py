@@ -0,0 +1,445 @@
+# Rules of the game (spawning, gravity, movement, rotation, locking, line clears and scoring)
+# This module does not depend on pygame so that games can be simulated without a display
+import random, struct
+from contextlib import nullcontext
+from collections import namedtuple
+from includes.board import Board
+from includes.pieces import PieceQueue
+
+# Actions that can be passed to Engine.step
+LEFT = 'l'
+RIGHT = 'r'
+ROTATE = 'rotate'
+DOWN = 'down'
+SOFT_DROP = 'soft'
+HARD_DROP = 'hard'
+ACTIONS = [None, LEFT, RIGHT, ROTATE, DOWN, SOFT_DROP, HARD_DROP]
+
+# Logic ticks per second, the game advances in fixed steps of 1 / TICK_RATE seconds
+TICK_RATE = 60
+
+# While the player speeds up the falling the tetromino moves down at every 0.1 second
+SOFT_DROP_TICKS = 6
+
+COLORS = ['red', 'cyan', 'yellow', 'orange', 'green', 'blue']
+
+# Rows pushed onto the board by the opponent in versus mode
+GARBAGE_COLOR = 'purple'
+
+# The board stores colors as indices into PALETTE + 1, 0 is an empty cell
+PALETTE = COLORS + [GARBAGE_COLOR]
+COLOR_CODES = {color: i + 1 for (i, color) in enumerate(PALETTE)}
+
+# Every tetris element as (squares, pivot point, number of possible spawn columns)
+# Squares and the pivot point are (col, row) offsets from the leftmost column of the element
+# The pivot point is the center of rotation, it is fractional for the I and square shapes
+SHAPES = {
+  # |1|
+  # |2|
+  # |3|4|
+  'L': [((0, -1), (0, 0), (0, 1), (1, 1)), (1, 0), 10],
+  #   |4|
+  #   |3|
+  # |1|2|
+  'LInv': [((0, 1), (1, 1), (1, 0), (1, -1)), (1, 0), 10],
+  # |1|2|3|4|
+  'I': [((0, -1), (1, -1), (2, -1), (3, -1)), (1.5, -0.5), 7],
+  # |1|2|
+  # |3|4|
+  'square': [((0, -1), (1, -1), (0, 0), (1, 0)), (0.5, -0.5), 10],
+  # |1|2|
+  #   |3|4|
+  'Z': [((0, -1), (1, -1), (1, 0), (2, 0)), (1, 0), 8],
+  #   |3|4|
+  # |1|2|
+  'ZInv': [((0, 0), (1, 0), (1, -1), (2, -1)), (1, 0), 8],
+  # |1|2|3|
+  #   |4|
+  'T': [((0, -1), (1, -1), (2, -1), (1, 0)), (1, 0), 8]
+}
+SHAPE_NAMES = ['L', 'LInv', 'I', 'square', 'Z', 'ZInv', 'T']
+
+def orientationTable(offsets, pivot):
+  """
+    Offsets of the squares in the 4 orientations of a shape, each one a 90 deg rotation of the
+    previous one around the pivot point
+    The pivot point only appears as the sum and the difference of its coordinates, which are whole
+    numbers for every shape, so the table holds integers only
+  """
+  (a, b) = (round(pivot[0] - pivot[1]), round(pivot[0] + pivot[1]))
+  table = [tuple(offsets)]
+  for _ in range(3):
+    table.append(tuple((r + a, b - c) for (c, r) in table[-1]))
+  return table
+
+# Rotation tables: the square offsets of every orientation of a shape, from the spawn column of
+# the tetromino, and the leftmost and rightmost offsets of each orientation
+ORIENTATIONS = {name: orientationTable(*SHAPES[name][:2]) for name in SHAPE_NAMES}
+EXTENTS = {name: [(min(c for (c, _) in cells), max(c for (c, _) in cells))
+                  for cells in ORIENTATIONS[name]] for name in SHAPE_NAMES}
+
+def spawnCols(width):
+  """
+    Number of columns every shape can appear in on a map of the given width; the table above is
+    for the default 12 columns, on other widths the rightmost column moves with the wall
+  """
+  return {name: max(SHAPES[name][2] + width - 12, 1) for name in SHAPE_NAMES}
+
+def gravityTicks(level):
+  """
+    Number of logic ticks between two gravity steps at a given level
+    At level 0 the tetromino falls 1 unit per second, every level makes it 20% faster
+  """
+  return max(1, round(TICK_RATE * 0.8 ** level))
+
+def linePoints(n):
+  """
+    Points given for clearing n rows at once
+  """
+  return n * (n - 1) * 100
+
+def garbageRows(n):
+  """
+    Rows sent to the opponent in versus mode for clearing n rows at once
+  """
+  return n if n >= 4 else max(n - 1, 0)
+
+NO_SPAN = nullcontext()
+
+def noSpan(name):
+  return NO_SPAN
+
+# Outcome of a single Engine.step call
+# locked: the squares of the tetromino that got fixed on the board (None if it can still move)
+# cleared: indices of the rows that have been cleared, points: score gained during the step
+StepResult = namedtuple('StepResult', ['moved', 'locked', 'cleared', 'points'])
+
+# Layout of Engine.serialize: header, the current and the next tetromino, then the color codes of
+# the board packed 2 cells per byte; sizes and coordinates are 16 bit so large maps fit too
+# A tetromino is stored as its shape, color, orientation and the cell its offsets start from
+STATE_HEADER = struct.Struct('<4sHHBQIIIIHBB')
+STATE_PIECE = struct.Struct('<BBBhh')
+STATE_MAGIC = b'TTS3'
+
+class Piece:
+  """
+    The falling tetromino: its shape, color, orientation (an index into ORIENTATIONS), the cell
+    the offsets of the orientation start from and its squares
+  """
+  __slots__ = ('shape', 'color', 'rotation', 'col', 'row', 'squares')
+
+  def __init__(self, shape, color, col, row = 0, rotation = 0):
+    self.shape = shape
+    self.color = color
+    self.rotation = rotation
+    self.col = col
+    self.row = row
+    self.squares = self.rotated(0, 0)
+
+  def shifted(self, dx, dy):
+    return [(c + dx, r + dy) for (c, r) in self.squares]
+
+  def rotated(self, turns = 1, dx = 0, dy = 0):
+    """
+      Squares of the tetromino after the given number of 90 deg rotations and a shift
+    """
+    (col, row) = (self.col + dx, self.row + dy)
+    return [(col + c, row + r) for (c, r) in ORIENTATIONS[self.shape][(self.rotation + turns) % 4]]
+
+  def moveTo(self, squares, dx = 0, dy = 0, turns = 0):
+    self.squares = squares
+    self.col += dx
+    self.row += dy
+    self.rotation = (self.rotation + turns) % 4
+
+class Engine:
+  """
+    A single game of tetris that advances by one action at a time
+  """
+  def __init__(self, seed = None, width = 12, height = 23, bag = False):
+    self.board = Board(width, height)
+    # Measures the phases of a step, e.g. Profiler.span (see includes/profiler.py)
+    self.span = noSpan
+    # Draw the shapes as shuffled bags of all seven instead of independently
+    self.bag = bag
+    self.reset(seed)
+
+  def reset(self, seed = None):
+    """
+      Start a new game; the same seed always produces the same sequence of tetrominos
+    """
+    if seed is None:
+      seed = random.getrandbits(64)
+    self.seed = seed
+    self.queue = self.newQueue()
+    self.board.reset()
+    self.score = 0
+    self.lines = 0
+    self.pieces = 0
+    self.ticks = 0
+    self.gravityCounter = 0
+    self.gameOver = False
+    # Why the game ended: 'blockOut' (a new tetromino overlaps the blocks), 'lockOut' (a new
+    # tetromino cannot fall at all) or 'garbage' (pushed out of the board by the opponent)
+    self.topOut = None
+    self.current = None
+    self.next = self.nextPiece()
+    self.spawn()
+
+  def snapshot(self):
+    """
+      Copy of the whole state of the game (see restore); costs a copy of the board
+    """
+    pieces = [(p.shape, p.color, p.col, p.row, p.rotation) for p in (self.current, self.next)]
+    return [self.board.copy(), pieces, self.seed, self.bag, self.score, self.lines, self.pieces,
+            self.ticks, self.gravityCounter, self.gameOver, self.topOut, self.queue.position]
+
+  def restore(self, state):
+    """
+      Continue the game from a snapshot
+    """
+    (board, pieces, self.seed, self.bag, self.score, self.lines, self.pieces, self.ticks,
+     self.gravityCounter, self.gameOver, self.topOut, position) = state
+    self.board.restore(board)
+    (self.current, self.next) = [Piece(*piece) for piece in pieces]
+    self.queue = self.newQueue()
+    self.queue.seek(position)
+
+  def newQueue(self):
+    return PieceQueue(self.seed, SHAPE_NAMES, COLORS, spawnCols(self.board.width), self.bag)
+
+  def serialize(self):
+    """
+      The state of the game in a couple of hundred bytes (see deserialize)
+      The sequence of tetrominos is continued from the seed and the number of tetrominos
+    """
+    board = self.board
+    data = [STATE_HEADER.pack(STATE_MAGIC, board.width, board.height, board.hidden, self.seed,
+                              self.score, self.lines, self.pieces, self.ticks,
+                              self.gravityCounter, self.gameOver, self.bag)]
+    for piece in (self.current, self.next):
+      data.append(STATE_PIECE.pack(SHAPE_NAMES.index(piece.shape), COLOR_CODES[piece.color],
+                                   piece.rotation, piece.col, piece.row))
+    grid = board.grid.tobytes() + b'\0'
+    data.append(bytes((grid[i] << 4) | grid[i + 1] for i in range(0, len(board.grid), 2)))
+    return b''.join(data)
+
+  def deserialize(self, data):
+    """
+      Continue the game from the output of serialize
+    """
+    (magic, width, height, hidden, self.seed, self.score, self.lines, self.pieces, self.ticks,
+     self.gravityCounter, gameOver, bag) = STATE_HEADER.unpack_from(data)
+    if magic != STATE_MAGIC:
+      raise ValueError('not a saved game')
+    total = height + hidden
+    offset = STATE_HEADER.size
+    if len(data) != offset + 2 * STATE_PIECE.size + (total * width + 1) // 2:
+      raise ValueError('saved game of the wrong length')
+    self.gameOver = bool(gameOver)
+    self.topOut = None
+
+    pieces = []
+    for _ in range(2):
+      (shape, color, rotation, col, row) = STATE_PIECE.unpack_from(data, offset)
+      offset += STATE_PIECE.size
+      pieces.append(Piece(SHAPE_NAMES[shape], PALETTE[color - 1], col, row, rotation))
+    (self.current, self.next) = pieces
+
+    self.board = Board(width, height, hidden)
+    grid = bytearray()
+    for byte in data[offset:]:
+      grid += bytes((byte >> 4, byte & 0xf))
+    del grid[total * width:]
+    rows = [sum(1 << c for c in range(width) if grid[r * width + c]) for r in range(total)]
+    self.board.restore((rows, grid))
+
+    # Every spawned tetromino and the preview have been taken from the queue
+    self.bag = bool(bag)
+    self.queue = self.newQueue()
+    self.queue.seek(self.pieces + 1)
+
+  def level(self):
+    """
+      Every 10 cleared rows increase the level by 1
+    """
+    return self.lines // 10
+
+  def tick(self, softDrop = False):
+    """
+      Advance the game by one logic tick
+      Returns the gravity action that is due at this tick or None
+    """
+    if self.gameOver:
+      return None
+
+    self.ticks += 1
+    self.gravityCounter += 1
+    interval = gravityTicks(self.level())
+    if softDrop:
+      interval = min(interval, SOFT_DROP_TICKS)
+    if self.gravityCounter < interval:
+      return None
+
+    self.gravityCounter = 0
+    return SOFT_DROP if softDrop else DOWN
+
+  def nextPiece(self):
+    """
+      Take the next tetris element (random color, shape and starting column) from the queue
+    """
+    return Piece(*self.queue.pop())
+
+  def preview(self, count):
+    """
+      The next count tetris elements, starting with self.next
+    """
+    return [self.next] + [Piece(*spec) for spec in self.queue.peek(count - 1)]
+
+  def spawn(self):
+    """
+      The next element becomes the current one
+      If it cannot move at all when it appears, the game is over
+    """
+    self.current = self.next
+    self.next = self.nextPiece()
+    self.pieces += 1
+    if self.board.collides(self.current.squares):
+      (self.gameOver, self.topOut) = (True, 'blockOut')
+    elif self.isResting():
+      (self.gameOver, self.topOut) = (True, 'lockOut')
+
+  def fits(self, squares):
+    """
+      Check that the squares are within the map and do not collide with fixed blocks
+    """
+    for (c, r) in squares:
+      if c < 0 or c >= self.board.width or r >= self.board.height:
+        return False
+    return not self.board.collides(squares)
+
+  def isResting(self):
+    """
+      Check if the current tetromino has reached the bottom of the map or the top of another
+      tetromino
+    """
+    for (c, r) in self.current.squares:
+      if r == self.board.height - 1 or self.board.isOccupied(c, r + 1):
+        return True
+    return False
+
+  def ghost(self):
+    """
+      Squares where the current tetromino would land if it was dropped straight down
+    """
+    return self.current.shifted(0, self.board.dropDistance(self.current.squares))
+
+  def move(self, dx, dy):
+    squares = self.current.shifted(dx, dy)
+    if not self.fits(squares):
+      return False
+    self.current.moveTo(squares, dx, dy)
+    return True
+
+  def rotate(self):
+    """
+      Rotate the current tetromino, the rotation is not allowed at the top of the map
+      If the rotation places the element out of the map at the sides shift it back; there are no
+      other kicks, a rotation that does not fit is not done
+    """
+    piece = self.current
+    for (_, r) in piece.squares:
+      if r <= 0:
+        return False
+
+    (left, right) = EXTENTS[piece.shape][(piece.rotation + 1) % 4]
+    if piece.col + left < 0:
+      dx = -piece.col - left
+    elif piece.col + right >= self.board.width:
+      dx = self.board.width - 1 - piece.col - right
+    else:
+      dx = 0
+
+    squares = piece.rotated(1, dx)
+    if not self.fits(squares):
+      return False
+    piece.moveTo(squares, dx, 0, 1)
+    return True
+
+  def lock(self):
+    """
+      Fix the current tetromino on the board, clear the filled rows and spawn the next element
+      Returns the fixed squares, the cleared rows and the points gained
+    """
+    squares = self.current.squares
+    code = COLOR_CODES[self.current.color]
+    for (c, r) in squares:
+      self.board.place(c, r, code)
+
+    # Only the rows of the tetromino can have been filled
+    with self.span('rowCheck'):
+      cleared = self.board.fullRows(set(r for (_, r) in squares))
+    points = 0
+    if cleared:
+      self.board.clearRows(cleared)
+      self.lines += len(cleared)
+      points = linePoints(len(cleared))
+      self.score += points
+
+    self.spawn()
+    return [squares, cleared, points]
+
+  def step(self, action):
+    """
+      Apply an action to the current tetromino
+      DOWN is a gravity step, SOFT_DROP is a gravity step while the player speeds up the falling
+      of the tetromino which is worth 1 point, HARD_DROP drops the tetromino to where it lands
+      (2 points per row) and locks it
+    """
+    if self.gameOver:
+      return StepResult(False, None, [], 0)
+
+    points = 0
+    if action == LEFT:
+      moved = self.move(-1, 0)
+    elif action == RIGHT:
+      moved = self.move(1, 0)
+    elif action == ROTATE:
+      moved = self.rotate()
+    elif action == DOWN or action == SOFT_DROP:
+      moved = self.move(0, 1)
+      if action == SOFT_DROP:
+        points += 1
+        self.score += 1
+    elif action == HARD_DROP:
+      distance = self.board.dropDistance(self.current.squares)
+      moved = self.move(0, distance) if distance else False
+      points += 2 * distance
+      self.score += 2 * distance
+    else:
+      moved = False
+
+    # A tetromino that cannot fall any further is fixed immediately
+    if not self.isResting():
+      return StepResult(moved, None, [], points)
+
+    (locked, cleared, linePts) = self.lock()
+    return StepResult(moved, locked, cleared, points + linePts)
+
+  def addGarbage(self, n, hole):
+    """
+      Versus mode: push the fixed blocks up by n rows that are full except for the hole column
+      The current tetromino is moved up if it would overlap them; if it cannot be, the game is over
+    """
+    if self.gameOver or n <= 0:
+      return
+    if not self.board.insertRows(n, hole, COLOR_CODES[GARBAGE_COLOR]):
+      (self.gameOver, self.topOut) = (True, 'garbage')
+      return
+
+    for dy in range(n + 1):
+      squares = self.current.shifted(0, -dy)
+      if min(r for (_, r) in squares) >= -self.board.hidden and not self.board.collides(squares):
+        self.current.moveTo(squares, 0, -dy)
+        return
+    (self.gameOver, self.topOut) = (True, 'garbage')
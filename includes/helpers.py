@@ -1,6 +1,6 @@
-import re
-
 # Helper functions
+from includes.constants import PANEL_WIDTH, CELL_SIZE
+
 def formatSec(secs):
   """
     Given some elapsed time in seconds output time in HH:MM:SS format
@@ -29,15 +29,11 @@ def formatSec(secs):
   output += zeroPrefix(secs)
   return output
 
-def getData():
-  with open('data.txt', 'r') as f:
-    return f.read()
-
-def getHighScore():
+def getHighScore(path = 'data.txt'):
   """
-    Get current high score saved in file
+    Get the high score saved in data.txt (or the given file) by older versions of the game
   """
-  with open('data.txt', 'r') as f:
+  with open(path, 'r') as f:
     s = f.read()    
     dataArr = [x for x in s.split(';;;') if '=' in x]
     for el in dataArr:
@@ -45,47 +41,9 @@ def getHighScore():
       if k == 'hs':
         return int(v)
 
-def updateHighScore(highScore):
-  """
-    Write a new high score to file
-  """
-  s = getData()
-  hsText = 'hs=' + str(highScore)
-  with open('data.txt', 'w') as f:
-    d = re.sub(r'hs=\d+', hsText, s)
-    f.write(d)
-
-def checkCollision(currentElement, elements, xShift, yShift, rotate = False):
+def cellPos(cell):
   """
-    Check that if the player moves the current tetromino to left, right or down will it collide
-    with other tetromino elements already on the map
+    Convert a (col, row) cell of the map to a pixel position on the screen
+    The map starts PANEL_WIDTH px from the left side of the screen and each cell is CELL_SIZE px wide
   """
-  # Simulate a movement to L/R/D or rotation
-  elementsPos = []
-  size = currentElement[0].size;
-  if rotate:
-    for sq in currentElement:
-      xOld = sq.pos.left
-      newX = sq.pos.top + sq.pivotPoint[0] - sq.pivotPoint[1]
-      newY = sq.pivotPoint[0] + sq.pivotPoint[1] - xOld - size
-      elementsPos.append((newX, newY))
-  else:
-    for sq in currentElement:
-      elementsPos.append((sq.pos[0] + xShift, sq.pos[1] + yShift)) 
-
-  # Filter out the current element from all elements
-  for sq2 in currentElement:
-    for sq1 in elements:
-      if sq1 is sq2:
-        elements.remove(sq1)
-
-  # Check for collision
-  othersPos = []
-  for sq in elements:
-    othersPos.append((sq.pos[0], sq.pos[1]))
-
-  for (x1, y1) in othersPos:
-    for (x2, y2) in elementsPos:
-      if abs(x1 - x2) < size and abs(y1 - y2) < size:
-        return True 
-  return False
+  return (PANEL_WIDTH + cell[0] * CELL_SIZE, cell[1] * CELL_SIZE)
@@ -0,0 +1,351 @@
+# Game server hosting many sessions in one process: a single asyncio task steps every room at the
+# logic tick rate and sends each client one message per tick with only what changed on the boards
+# Messages are JSON objects, one per line
+#   client -> server: {"type": "join", "mode": "versus" | "solo", "room": name (optional)}
+#                     {"type": "input", "action": "l" | "r" | "rotate" | "soft" | "hard"}
+#                     {"type": "stats"}
+#   server -> client: joined, start, update (every tick something changed), over, stats
+import asyncio, json, random, time
+from collections import deque
+from includes.engine import (Engine, TICK_RATE, LEFT, RIGHT, ROTATE, SOFT_DROP, HARD_DROP,
+                             COLOR_CODES, garbageRows)
+
+INPUTS = [LEFT, RIGHT, ROTATE, SOFT_DROP, HARD_DROP]
+
+# Clients that have this many bytes of updates waiting to be sent are disconnected
+MAX_BUFFERED = 1 << 20
+
+def encode(message):
+  return (json.dumps(message, separators = (',', ':')) + '\n').encode()
+
+class Session:
+  """
+    One game on the server and the part of its state that has already been sent to the clients
+  """
+  def __init__(self, id, seed):
+    self.id = id
+    self.engine = Engine(seed)
+    self.inputs = []
+    board = self.engine.board
+    self.sent = [board.row(row) for row in range(board.height)]
+    self.boardChanged = True
+    self.sentPiece = None
+    self.sentStats = None
+
+  def step(self):
+    """
+      Apply the inputs received since the last tick and gravity; returns the number of cleared rows
+    """
+    (actions, self.inputs) = (self.inputs, [])
+    gravity = self.engine.tick()
+    if gravity:
+      actions.append(gravity)
+
+    cleared = 0
+    for action in actions:
+      result = self.engine.step(action)
+      if result.locked:
+        self.boardChanged = True
+        cleared += len(result.cleared)
+    return cleared
+
+  def addGarbage(self, n, hole):
+    self.engine.addGarbage(n, hole)
+    self.boardChanged = True
+
+  def delta(self):
+    """
+      What changed since the last call as a dict (empty if nothing did)
+      cells is a flat list of (col, row, color code) triples of the visible map (see PALETTE in
+      includes/engine.py)
+    """
+    engine = self.engine
+    update = {}
+    if self.boardChanged:
+      cells = []
+      for (row, sent) in enumerate(self.sent):
+        current = engine.board.row(row)
+        if current == sent:
+          continue
+        for (col, code) in enumerate(current):
+          if code != sent[col]:
+            cells += [col, row, code]
+        self.sent[row] = current
+      if cells:
+        update['cells'] = cells
+      self.boardChanged = False
+
+    piece = tuple(engine.current.squares)
+    if piece != self.sentPiece:
+      update['piece'] = [COLOR_CODES[engine.current.color]] + [n for sq in piece for n in sq]
+      self.sentPiece = piece
+
+    stats = (engine.score, engine.lines, engine.next.shape)
+    if stats != self.sentStats:
+      (update['score'], update['lines'], update['next']) = stats
+      self.sentStats = stats
+    return update
+
+class Room:
+  """
+    Games played side by side; in versus mode cleared rows are sent to the opponents as garbage
+    Every player of a room gets the same tetrominos
+  """
+  def __init__(self, name, size, seed):
+    self.name = name
+    self.size = size
+    self.seed = seed
+    self.rng = random.Random(seed)
+    # [session, writer] pairs
+    self.players = []
+    self.started = False
+    self.finished = False
+    self.ticks = 0
+
+  def add(self, session, writer):
+    self.players.append([session, writer])
+    if len(self.players) == self.size:
+      self.started = True
+      self.broadcast(encode({
+        'type': 'start',
+        'players': [s.id for (s, _) in self.players],
+        'width': session.engine.board.width,
+        'height': session.engine.board.height
+      }))
+
+  def remove(self, session):
+    self.players = [p for p in self.players if p[0] is not session]
+    if self.started:
+      # Leaving a running game is a loss
+      session.engine.gameOver = True
+    if not self.players:
+      self.finished = True
+
+  def broadcast(self, data):
+    """
+      Queue the same bytes for every client; the ones that stopped reading are dropped
+      Their connection is aborted since closing it would wait for the unsent data to drain
+    """
+    stalled = []
+    for (session, writer) in self.players:
+      if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+        writer.transport.abort()
+        stalled.append(session)
+        continue
+      writer.write(data)
+    for session in stalled:
+      self.remove(session)
+
+  def tick(self):
+    self.ticks += 1
+    sessions = [s for (s, _) in self.players if not s.engine.gameOver]
+    for session in sessions:
+      n = garbageRows(session.step())
+      if n and self.size > 1:
+        hole = self.rng.randrange(session.engine.board.width)
+        for other in sessions:
+          if other is not session:
+            other.addGarbage(n, hole)
+
+    # One message per tick with the changes of every board in the room
+    boards = []
+    for (session, _) in self.players:
+      update = session.delta()
+      if update:
+        update['id'] = session.id
+        boards.append(update)
+    data = b''
+    if boards:
+      data = encode({'type': 'update', 'tick': self.ticks, 'boards': boards})
+
+    alive = [s for (s, _) in self.players if not s.engine.gameOver]
+    if len(alive) < min(self.size, 2):
+      self.finished = True
+      winner = alive[0].id if alive else None
+      data += encode({'type': 'over', 'winner': winner,
+                      'scores': {s.id: s.engine.score for (s, _) in self.players}})
+    if data:
+      self.broadcast(data)
+
+class GameServer:
+  """
+    Rooms are matched by name; versus players without a room name are paired in join order
+  """
+  def __init__(self, roomSize = 2, seed = None, window = 600):
+    self.roomSize = roomSize
+    self.rng = random.Random(seed)
+    self.rooms = {}
+    self.open = None
+    self.nextId = 1
+    self.tickTimes = deque(maxlen = window)
+    self.lateTicks = 0
+
+  async def start(self, host = '127.0.0.1', port = 7777):
+    self.server = await asyncio.start_server(self.handle, host, port)
+    self.loop = asyncio.create_task(self.run())
+    return self.server.sockets[0].getsockname()[1]
+
+  async def stop(self):
+    self.loop.cancel()
+    for room in self.rooms.values():
+      for (_, writer) in room.players:
+        writer.close()
+    self.server.close()
+    await self.server.wait_closed()
+
+  def newName(self, kind, id):
+    """
+      Name of a room created by the server; clients can choose names of the same form, so a
+      suffix is added until the name is not taken
+    """
+    name = '%s-%d' % (kind, id)
+    n = 1
+    while name in self.rooms:
+      name = '%s-%d-%d' % (kind, id, n)
+      n += 1
+    return name
+
+  def join(self, message, writer):
+    session = Session(self.nextId, None)
+    self.nextId += 1
+    name = message.get('room')
+    if message.get('mode') == 'solo':
+      room = Room(self.newName('solo', session.id), 1, self.rng.getrandbits(64))
+    elif name is None and self.open and not (self.open.started or self.open.finished):
+      room = self.open
+    else:
+      room = self.rooms.get(name)
+      if room is None or room.started:
+        # A full room keeps its name, the player gets a new one
+        if name is None or room is not None:
+          name = self.newName('versus', session.id)
+        room = Room(name, self.roomSize, self.rng.getrandbits(64))
+        if message.get('room') is None:
+          self.open = room
+    # Rooms are only ever added under a free name, a room that is in use is never replaced
+    self.rooms.setdefault(room.name, room)
+
+    session.engine.reset(room.seed)
+    writer.write(encode({'type': 'joined', 'id': session.id, 'room': room.name}))
+    room.add(session, writer)
+    return [session, room]
+
+  async def handle(self, reader, writer):
+    (session, room) = (None, None)
+    try:
+      async for line in reader:
+        try:
+          message = json.loads(line)
+        except ValueError:
+          break
+        # Anything but an object (with a string as the room name, if any) ends the connection too
+        if not isinstance(message, dict):
+          break
+        if message.get('room') is not None and not isinstance(message['room'], str):
+          break
+        kind = message.get('type')
+        if kind == 'join' and session is None:
+          (session, room) = self.join(message, writer)
+        elif kind == 'input' and session and message.get('action') in INPUTS:
+          session.inputs.append(message['action'])
+        elif kind == 'stats':
+          writer.write(encode(dict(self.stats(), type = 'stats')))
+    except (ConnectionError, asyncio.CancelledError):
+      # The client went away or the server is shutting down
+      pass
+    finally:
+      if room:
+        room.remove(session)
+      writer.close()
+
+  async def run(self):
+    """
+      Step every running room at each logic tick; ticks are skipped instead of piling up when the
+      server is overloaded
+    """
+    tickLength = 1 / TICK_RATE
+    nextTick = time.monotonic()
+    while True:
+      start = time.perf_counter()
+      for room in list(self.rooms.values()):
+        if room.started and not room.finished:
+          room.tick()
+        if room.finished:
+          del self.rooms[room.name]
+      self.tickTimes.append(time.perf_counter() - start)
+
+      nextTick += tickLength
+      delay = nextTick - time.monotonic()
+      if delay < 0:
+        self.lateTicks += 1
+        nextTick = time.monotonic()
+      await asyncio.sleep(max(delay, 0))
+
+  def stats(self):
+    """
+      Load of the tick loop; the whole server runs on one core so tickSessionsPerCore is the
+      number of sessions that would fill the tick budget at the current cost per session
+      Only the time spent stepping the rooms is counted: reading sockets, parsing the inputs and
+      the event loop itself come on top, so the real capacity is lower
+    """
+    sessions = sum(len(room.players) for room in self.rooms.values() if room.started)
+    tickTime = sum(self.tickTimes) / len(self.tickTimes) if self.tickTimes else 0
+    tickLoad = tickTime * TICK_RATE
+    return {
+      'rooms': len(self.rooms),
+      'sessions': sessions,
+      'tickMs': tickTime * 1000,
+      'tickLoad': tickLoad,
+      'lateTicks': self.lateTicks,
+      'tickSessionsPerCore': int(sessions / tickLoad) if tickLoad and sessions else None
+    }
+
+class LocalClient:
+  """
+    Stand-in for a player: presses a random key about 5 times per second (like randomBot) and
+    rebuilds every board of its room from the updates
+  """
+  def __init__(self, mode = 'versus', room = None, seed = None, rate = 0.1):
+    self.mode = mode
+    self.room = room
+    self.rng = random.Random(seed)
+    self.rate = rate
+    self.id = None
+    self.boards = {}
+    self.pieces = {}
+    self.scores = {}
+    self.winner = None
+    self.updates = 0
+
+  def apply(self, message):
+    for update in message['boards']:
+      cells = self.boards.setdefault(update['id'], {})
+      flat = update.get('cells', [])
+      for i in range(0, len(flat), 3):
+        (col, row, code) = flat[i:i + 3]
+        if code:
+          cells[(col, row)] = code
+        else:
+          cells.pop((col, row), None)
+      if 'piece' in update:
+        self.pieces[update['id']] = update['piece']
+      if 'score' in update:
+        self.scores[update['id']] = update['score']
+    self.updates += 1
+
+  async def play(self, host, port):
+    (reader, writer) = await asyncio.open_connection(host, port)
+    writer.write(encode({'type': 'join', 'mode': self.mode, 'room': self.room}))
+    async for line in reader:
+      message = json.loads(line)
+      if message['type'] == 'joined':
+        self.id = message['id']
+      elif message['type'] == 'update':
+        self.apply(message)
+        if self.rng.random() < self.rate:
+          writer.write(encode({'type': 'input', 'action': self.rng.choice(INPUTS)}))
+      elif message['type'] == 'over':
+        self.winner = message['winner']
+        break
+    writer.close()
+    return self
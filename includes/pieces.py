@@ -0,0 +1,107 @@
+# Sequence of the tetrominos of a game, drawn from a counter-based random stream: the n-th value
+# of a stream is a hash of its key and n, so any position can be computed directly, the queue is
+# filled in bulk and streams split off with different keys never collide
+from collections import deque
+
+MASK64 = (1 << 64) - 1
+GOLDEN = 0x9e3779b97f4a7c15
+
+# Number of tetrominos computed at once when the queue runs low
+CHUNK = 64
+
+def mix64(z):
+  """
+    SplitMix64 finalizer: a bijective 64 bit hash
+  """
+  z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+  z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK64
+  return z ^ (z >> 31)
+
+class Stream:
+  """
+    Reproducible random numbers addressed by position; split derives an independent stream, e.g.
+    one per session or worker, without any coordination
+  """
+  __slots__ = ('key',)
+
+  def __init__(self, seed = 0, key = None):
+    self.key = mix64((seed + GOLDEN) & MASK64) if key is None else key
+
+  def split(self, index):
+    return Stream(key = mix64(self.key ^ mix64((index + GOLDEN) & MASK64)))
+
+  def value(self, n):
+    return mix64((self.key + (n + 1) * GOLDEN) & MASK64)
+
+  def below(self, n, bound):
+    """
+      The n-th value of the stream reduced to range(bound)
+    """
+    return self.value(n) % bound
+
+class PieceQueue:
+  """
+    Tetrominos of a game as (shape, color, spawn column); shapes are drawn independently or, with
+    bag = True, as shuffled bags of all seven shapes
+  """
+  def __init__(self, seed, shapes, colors, spawnCols, bag = False):
+    stream = Stream(seed)
+    (self.shapeStream, self.colorStream, self.colStream) = [stream.split(i) for i in range(3)]
+    self.shapes = shapes
+    self.colors = colors
+    self.spawnCols = spawnCols
+    self.bag = bag
+    self.bagIndex = None
+    self.position = 0
+    self.queue = deque()
+
+  def shuffledBag(self, index):
+    """
+      Shapes of a bag shuffled with Fisher-Yates
+    """
+    if index != self.bagIndex:
+      bag = list(self.shapes)
+      for i in range(len(bag) - 1, 0, -1):
+        j = self.shapeStream.below(index * len(bag) + i, i + 1)
+        (bag[i], bag[j]) = (bag[j], bag[i])
+      (self.bagIndex, self.bagShapes) = (index, bag)
+    return self.bagShapes
+
+  def piece(self, n):
+    """
+      The n-th tetromino of the game
+    """
+    if self.bag:
+      (index, i) = divmod(n, len(self.shapes))
+      shape = self.shuffledBag(index)[i]
+    else:
+      shape = self.shapes[self.shapeStream.below(n, len(self.shapes))]
+    color = self.colors[self.colorStream.below(n, len(self.colors))]
+    return (shape, color, self.colStream.below(n, self.spawnCols[shape]))
+
+  def fill(self, count):
+    """
+      Make sure that at least count tetrominos are queued
+    """
+    if len(self.queue) < count:
+      start = self.position + len(self.queue)
+      self.queue.extend(self.piece(n) for n in range(start, start + max(count, CHUNK)))
+
+  def peek(self, count):
+    """
+      The next count tetrominos without taking them
+    """
+    self.fill(count)
+    return [self.queue[i] for i in range(count)]
+
+  def pop(self):
+    self.fill(1)
+    self.position += 1
+    return self.queue.popleft()
+
+  def seek(self, position):
+    """
+      Continue the sequence from the given tetromino
+    """
+    self.position = position
+    self.queue.clear()
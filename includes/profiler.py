@@ -0,0 +1,122 @@
+# Opt-in instrumentation of the game loop: named spans, frame time percentiles and a Chrome trace
+# (chrome://tracing or https://ui.perfetto.dev) written on exit
+import json, time
+from collections import deque
+
+class NullSpan:
+  """
+    Returned when the profiler is disabled so that instrumented code pays for almost nothing
+  """
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+  __slots__ = ('profiler', 'name', 'start')
+
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.profiler.children.append(0)
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    end = time.perf_counter()
+    self.profiler.add(self.name, self.start, end, self.profiler.children.pop())
+    return False
+
+class Profiler:
+  """
+    Collects the time spent in every named phase of a frame and the time between frames
+    The time of a phase does not include the spans nested in it (they are phases of their own)
+    Only the last `window` frames are used for the statistics and the last `maxEvents` spans are
+    kept for the trace, so memory use stays flat
+  """
+  def __init__(self, enabled = False, window = 300, maxEvents = 200000):
+    self.enabled = enabled
+    self.origin = time.perf_counter()
+    self.events = deque(maxlen = maxEvents)
+    self.frameTimes = deque(maxlen = window)
+    self.frames = deque(maxlen = window)
+    self.current = {}
+    self.lastFrame = None
+    # Time spent in the nested spans of every open span
+    self.children = []
+
+  def span(self, name):
+    """
+      Context manager that measures a phase: with profiler.span('events'): ...
+    """
+    if not self.enabled:
+      return NULL_SPAN
+    return Span(self, name)
+
+  def add(self, name, start, end, nested = 0):
+    self.current[name] = self.current.get(name, 0) + end - start - nested
+    if self.children:
+      self.children[-1] += end - start
+    self.events.append((name, start, end))
+
+  def frame(self):
+    """
+      Mark the end of a presented frame
+    """
+    if not self.enabled:
+      return
+    now = time.perf_counter()
+    if self.lastFrame is not None:
+      self.frameTimes.append(now - self.lastFrame)
+      self.frames.append(self.current)
+    self.current = {}
+    self.lastFrame = now
+
+  def percentile(self, values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+  def report(self):
+    """
+      Frame time percentiles and the mean time of every phase per frame, in milliseconds
+    """
+    if not self.frameTimes:
+      return {'frame': {}, 'phases': {}}
+    frame = {'p%d' % (p * 100): self.percentile(self.frameTimes, p) * 1000
+             for p in (0.5, 0.95, 0.99)}
+    totals = {}
+    for phases in self.frames:
+      for (name, duration) in phases.items():
+        totals[name] = totals.get(name, 0) + duration
+    phases = {name: total / len(self.frames) * 1000 for (name, total) in totals.items()}
+    return {'frame': frame, 'phases': phases}
+
+  def overlayLines(self):
+    """
+      Text lines of the live overlay
+    """
+    report = self.report()
+    lines = ['%s %.1f' % (name, value) for (name, value) in report['frame'].items()]
+    for (name, value) in sorted(report['phases'].items(), key = lambda p: -p[1]):
+      lines.append('%s %.2f' % (name, value))
+    return lines
+
+  def dump(self, path):
+    """
+      Write the recorded spans as a Chrome trace-event JSON file
+    """
+    events = [{
+      'name': name,
+      'ph': 'X',
+      'ts': (start - self.origin) * 1e6,
+      'dur': (end - start) * 1e6,
+      'pid': 0,
+      'tid': 0
+    } for (name, start, end) in self.events]
+    with open(path, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
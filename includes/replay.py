@@ -0,0 +1,186 @@
+# Compact replays: the seed, flags and board size of the game followed by every action as
+# (tick delta, action) varints
+# A separate index file holds periodic keyframes (the engine state of Engine.serialize) so that
+# playback can jump to any tick without simulating the game from the start
+# Replays come from the players whose scores they back up, so they are only ever parsed as data:
+# anything truncated or malformed raises ValueError
+import mmap, struct
+from bisect import bisect_right
+from includes.engine import Engine, ACTIONS, STATE_HEADER
+
+MAGIC = b'TTRP'
+# Version 2: keyframes hold the compact board of includes/board.py
+# Version 3: the seed is followed by the flags of the game (1: 7-bag)
+# Version 4: the flags are followed by the board size, keyframes are the output of Engine.serialize
+VERSION = 4
+
+# A varint never takes more bytes than a 64 bit number needs
+MAX_VARINT = 10
+
+# Largest board a replay may claim, so a crafted file cannot make playback allocate gigabytes
+MAX_CELLS = 1 << 20
+
+def writeVarint(f, n):
+  while n >= 0x80:
+    f.write(bytes([(n & 0x7f) | 0x80]))
+    n >>= 7
+  f.write(bytes([n]))
+
+def readVarint(buf, offset):
+  """
+    Returns the decoded number and the offset right after it
+  """
+  n = 0
+  for shift in range(0, 7 * MAX_VARINT, 7):
+    if offset >= len(buf):
+      raise ValueError('truncated varint')
+    b = buf[offset]
+    offset += 1
+    n |= (b & 0x7f) << shift
+    if b < 0x80:
+      return [n, offset]
+  raise ValueError('malformed varint')
+
+class ReplayRecorder:
+  """
+    Writes the actions applied to an engine; record has to be called right before engine.step
+  """
+  def __init__(self, path, engine, keyframeTicks = 600):
+    self.engine = engine
+    self.keyframeTicks = keyframeTicks
+    self.log = open(path, 'wb')
+    self.index = open(path + '.idx', 'wb')
+    self.log.write(MAGIC + bytes([VERSION]))
+    writeVarint(self.log, engine.seed)
+    writeVarint(self.log, int(engine.bag))
+    writeVarint(self.log, engine.board.width)
+    writeVarint(self.log, engine.board.height)
+    self.lastTick = 0
+    self.lastKeyframe = 0
+
+  def record(self, action):
+    tick = self.engine.ticks
+    if tick - self.lastKeyframe >= self.keyframeTicks:
+      # The keyframe is the state right before the record that follows it in the log
+      snapshot = self.engine.serialize()
+      writeVarint(self.index, tick)
+      writeVarint(self.index, self.log.tell())
+      writeVarint(self.index, self.lastTick)
+      writeVarint(self.index, len(snapshot))
+      self.index.write(snapshot)
+      self.lastKeyframe = tick
+
+    writeVarint(self.log, tick - self.lastTick)
+    writeVarint(self.log, ACTIONS.index(action))
+    self.lastTick = tick
+
+  def close(self):
+    self.log.close()
+    self.index.close()
+
+class Keyframe:
+  def __init__(self, tick, offset, prevTick, start, length):
+    self.tick = tick
+    # Position of the next record in the log and the tick its delta is relative to
+    self.offset = offset
+    self.prevTick = prevTick
+    # Position of the snapshot in the index file
+    self.start = start
+    self.length = length
+
+class ReplayPlayer:
+  """
+    Plays a replay back at unlimited speed; both files are memory-mapped
+  """
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self.log = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    if self.log[:4] != MAGIC or self.log[4:5] != bytes([VERSION]):
+      raise ValueError(path + ' is not a replay')
+    (self.seed, offset) = readVarint(self.log, 5)
+    (flags, offset) = readVarint(self.log, offset)
+    (self.width, offset) = readVarint(self.log, offset)
+    (self.height, self.start) = readVarint(self.log, offset)
+    if not (0 < self.width and 0 < self.height and self.width * self.height <= MAX_CELLS):
+      raise ValueError('%s has a board of %d x %d cells' % (path, self.width, self.height))
+    self.bag = bool(flags & 1)
+
+    self.keyframes = []
+    self.index = b''
+    try:
+      with open(path + '.idx', 'rb') as f:
+        self.index = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+      # Missing or empty index: replays can still be played from the start
+      pass
+
+    offset = 0
+    while offset < len(self.index):
+      fields = []
+      for _ in range(4):
+        (n, offset) = readVarint(self.index, offset)
+        fields.append(n)
+      (tick, logOffset, prevTick, length) = fields
+      if offset + length > len(self.index) or not self.start <= logOffset <= len(self.log):
+        raise ValueError(path + '.idx is not the index of this replay')
+      self.keyframes.append(Keyframe(tick, logOffset, prevTick, offset, length))
+      offset += length
+    self.keyframeTicks = [k.tick for k in self.keyframes]
+
+  def newEngine(self):
+    return Engine(self.seed, width = self.width, height = self.height, bag = self.bag)
+
+  def records(self, offset, tick):
+    """
+      Yields (tick, action) for every record from a position of the log
+    """
+    while offset < len(self.log):
+      (delta, offset) = readVarint(self.log, offset)
+      (code, offset) = readVarint(self.log, offset)
+      if code >= len(ACTIONS):
+        raise ValueError('unknown action %d' % code)
+      tick += delta
+      yield (tick, ACTIONS[code])
+
+  def seek(self, tick):
+    """
+      Engine with the state of the game at the given tick (before the actions of that tick)
+      Starts from the last keyframe before the tick instead of the beginning of the game
+    """
+    engine = self.newEngine()
+    i = bisect_right(self.keyframeTicks, tick) - 1
+    (offset, lastTick) = (self.start, 0)
+    if i >= 0:
+      keyframe = self.keyframes[i]
+      data = self.index[keyframe.start:keyframe.start + keyframe.length]
+      try:
+        # The size is checked before deserialize allocates the board
+        if STATE_HEADER.unpack_from(data)[1:3] != (self.width, self.height):
+          raise ValueError('keyframe at tick %d is not of the board of the replay' % keyframe.tick)
+        engine.deserialize(data)
+      except (struct.error, IndexError) as e:
+        raise ValueError('malformed keyframe at tick %d' % keyframe.tick) from e
+      (offset, lastTick) = (keyframe.offset, keyframe.prevTick)
+
+    for (t, action) in self.records(offset, lastTick):
+      if t >= tick:
+        break
+      engine.ticks = t
+      engine.step(action)
+    engine.ticks = max(engine.ticks, tick)
+    return engine
+
+  def play(self):
+    """
+      Run the whole game and return the engine at its end
+    """
+    engine = self.newEngine()
+    for (tick, action) in self.records(self.start, 0):
+      engine.ticks = tick
+      engine.step(action)
+    return engine
+
+  def close(self):
+    self.log.close()
+    if self.keyframes:
+      self.index.close()
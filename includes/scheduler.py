@@ -0,0 +1,106 @@
+# Fixed timestep scheduling of the game loop
+import time
+
+class Scheduler:
+  """
+    Logic runs at a fixed tick rate and rendering is capped at a given number of frames per
+    second; between the two the loop sleeps instead of polling the clock
+  """
+  def __init__(self, tickRate, fps, maxCatchUp = 5):
+    self.tickLength = 1 / tickRate
+    self.frameLength = 1 / fps if fps else 0
+    # If the loop falls behind by more ticks than this, the backlog is dropped
+    self.maxCatchUp = maxCatchUp
+    self.reset()
+
+  def reset(self):
+    now = time.monotonic()
+    self.nextTick = now + self.tickLength
+    self.nextFrame = now
+
+  def dueTicks(self):
+    """
+      Number of logic ticks that have to be run since the last call
+    """
+    now = time.monotonic()
+    n = 0
+    while now >= self.nextTick and n < self.maxCatchUp:
+      self.nextTick += self.tickLength
+      n += 1
+
+    if now >= self.nextTick:
+      self.nextTick = now + self.tickLength
+    return n
+
+  def frameDue(self):
+    """
+      Check if a new frame should be presented
+    """
+    now = time.monotonic()
+    if now < self.nextFrame:
+      return False
+    self.nextFrame = max(self.nextFrame + self.frameLength, now)
+    return True
+
+  def idle(self):
+    """
+      Sleep until the next tick or frame is due
+    """
+    delay = min(self.nextTick, self.nextFrame) - time.monotonic()
+    if delay > 0:
+      time.sleep(delay)
+
+class FrameBudget:
+  """
+    Time budget of a pass of the game loop: low priority drawing (HUD text, the preview, the music
+    fade in) is queued as jobs that only run while the pass is within its budget and the previous
+    one did not overrun it; input and gravity are never queued
+    Queuing a job under a name that is already waiting replaces it, so only the latest state is
+    drawn; a job runs anyway once it has been skipped maxSkips times in a row
+  """
+  def __init__(self, budget, maxSkips = 30):
+    self.budget = budget
+    self.maxSkips = maxSkips
+    # name -> [function, arguments, times skipped]
+    self.jobs = {}
+    # Times every job has been skipped since the last clear
+    self.skipped = {}
+    self.overran = False
+    self.begin()
+
+  def begin(self):
+    """
+      Called at the start of every pass of the loop
+    """
+    self.start = time.perf_counter()
+
+  def defer(self, name, fn, *args):
+    skips = self.jobs[name][2] if name in self.jobs else 0
+    self.jobs[name] = [fn, args, skips]
+
+  def run(self):
+    """
+      Run the queued jobs that fit into the budget, the others wait for the next frame
+    """
+    for name in list(self.jobs):
+      job = self.jobs[name]
+      late = self.overran or time.perf_counter() - self.start > self.budget
+      if late and job[2] < self.maxSkips:
+        job[2] += 1
+        self.skipped[name] = self.skipped.get(name, 0) + 1
+        continue
+      del self.jobs[name]
+      job[0](*job[1])
+
+  def end(self):
+    """
+      Called once the frame has been presented
+    """
+    self.overran = time.perf_counter() - self.start > self.budget
+
+  def clear(self):
+    """
+      Drop the queued jobs and start counting the skips again, at the end of a game
+    """
+    self.jobs = {}
+    self.skipped = {}
@@ -0,0 +1,119 @@
+# Persistent high score, per player history and leaderboard
+import os, queue, sqlite3, threading, time
+from includes.helpers import getHighScore
+
+class ScoreStore:
+  """
+    The state is kept in memory and written to an SQLite database (in WAL mode) by a background
+    thread, so the game loop never waits for the disk and a crash cannot leave a half written
+    high score behind
+  """
+  def __init__(self, path = 'scores.db', legacyPath = 'data.txt'):
+    self.path = path
+    self.writes = queue.Queue()
+    self.lock = threading.Lock()
+    self.pendingHighScore = None
+
+    # Reads happen on the main thread through their own connection
+    self.reader = self.connect()
+    row = self.reader.execute("SELECT value FROM meta WHERE key = 'hs'").fetchone()
+    if row is not None:
+      self.highScore = row[0]
+    else:
+      # Import the high score of older versions that stored it in data.txt (legacyPath)
+      self.highScore = 0
+      if os.path.exists(legacyPath):
+        self.highScore = getHighScore(legacyPath) or 0
+      with self.reader:
+        self.reader.execute("INSERT INTO meta VALUES ('hs', ?)", (self.highScore,))
+
+    self.thread = threading.Thread(target = self.writer, daemon = True)
+    self.thread.start()
+
+  def connect(self):
+    conn = sqlite3.connect(self.path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.executescript('''
+      CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+      CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY,
+        player TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        lines INTEGER NOT NULL,
+        duration INTEGER NOT NULL,
+        playedAt REAL NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS gamesByScore ON games (score DESC);
+      CREATE INDEX IF NOT EXISTS gamesByPlayer ON games (player, playedAt DESC);
+    ''')
+    return conn
+
+  def updateHighScore(self, highScore):
+    """
+      Set a new high score; repeated updates before the next write are merged into one
+    """
+    self.highScore = highScore
+    with self.lock:
+      scheduled = self.pendingHighScore is not None
+      self.pendingHighScore = highScore
+    if not scheduled:
+      self.writes.put('hs')
+
+  def recordGame(self, player, score, lines, duration):
+    """
+      Add a finished game to the history of the player
+    """
+    self.writes.put(('game', (player, score, lines, duration, time.time())))
+
+  def leaderboard(self, n = 10):
+    """
+      Top n games as (player, score, lines, duration) tuples
+    """
+    return self.reader.execute('''
+      SELECT player, score, lines, duration FROM games ORDER BY score DESC LIMIT ?
+    ''', (n,)).fetchall()
+
+  def history(self, player, n = 10):
+    """
+      Last n games of a player as (score, lines, duration, playedAt) tuples
+    """
+    return self.reader.execute('''
+      SELECT score, lines, duration, playedAt FROM games WHERE player = ?
+      ORDER BY playedAt DESC LIMIT ?
+    ''', (player, n)).fetchall()
+
+  def writer(self):
+    """
+      Background thread: everything that is queued at once is written in a single transaction
+    """
+    conn = self.connect()
+    running = True
+    while running:
+      items = [self.writes.get()]
+      while not self.writes.empty():
+        items.append(self.writes.get())
+
+      with conn:
+        for item in items:
+          if item is None:
+            running = False
+          elif item == 'hs':
+            with self.lock:
+              highScore = self.pendingHighScore
+              self.pendingHighScore = None
+            if highScore is not None:
+              conn.execute("UPDATE meta SET value = ? WHERE key = 'hs'", (highScore,))
+          else:
+            conn.execute('''
+              INSERT INTO games (player, score, lines, duration, playedAt) VALUES (?, ?, ?, ?, ?)
+            ''', item[1])
+    conn.close()
+
+  def close(self):
+    """
+      Write everything that is still queued and stop the background thread
+    """
+    if self.thread.is_alive():
+      self.writes.put(None)
+      self.thread.join()
@@ -0,0 +1,167 @@
+# Gameplay telemetry: events go into a bounded ring buffer in memory and a background thread writes
+# them to JSONL files that are rotated by size (and optionally gzipped)
+# The game loop only appends to the buffer; when the writer falls behind the oldest events are
+# dropped, so memory use stays flat
+import glob, gzip, json, os, shutil, threading, time
+from bisect import bisect_right
+from collections import deque
+from includes.engine import TICK_RATE
+
+# Upper bounds (in ms) of the buckets of the frame time histogram, the last bucket is open
+FRAME_BUCKETS = [4, 8, 17, 33, 50, 100]
+
+# Seconds between two points of the score timeline of a game
+TIMELINE_STEP = 5
+
+class Telemetry:
+  """
+    Ring buffer of events and the thread that writes them to directory/telemetry.jsonl
+    Full files are renamed with a timestamp and only the newest `backups` of them are kept
+  """
+  def __init__(self, directory = None, capacity = 10000, maxBytes = 10 << 20, backups = 10,
+               compress = False, interval = 1):
+    self.enabled = directory is not None
+    self.directory = directory
+    self.buffer = deque(maxlen = capacity)
+    # Events pushed out of the full buffer; counted on the game thread and reset by the writer
+    self.dropped = 0
+    self.droppedLock = threading.Lock()
+    self.maxBytes = maxBytes
+    self.backups = backups
+    self.compress = compress
+    self.interval = interval
+    self.stopping = threading.Event()
+    if self.enabled:
+      os.makedirs(directory, exist_ok = True)
+      self.path = os.path.join(directory, 'telemetry.jsonl')
+      self.thread = threading.Thread(target = self.writer, daemon = True)
+      self.thread.start()
+
+  def emit(self, kind, **fields):
+    """
+      Queue an event; never blocks
+    """
+    if not self.enabled:
+      return
+    if len(self.buffer) == self.buffer.maxlen:
+      with self.droppedLock:
+        self.dropped += 1
+    fields['type'] = kind
+    fields['t'] = round(time.time(), 3)
+    self.buffer.append(fields)
+
+  def writer(self):
+    f = open(self.path, 'a')
+    while True:
+      stopping = self.stopping.wait(self.interval)
+      lines = []
+      while self.buffer:
+        lines.append(json.dumps(self.buffer.popleft(), separators = (',', ':')))
+      with self.droppedLock:
+        (dropped, self.dropped) = (self.dropped, 0)
+      if dropped:
+        lines.append(json.dumps({'type': 'dropped', 'count': dropped, 't': time.time()}))
+      if lines:
+        f.write('\n'.join(lines) + '\n')
+        f.flush()
+        if f.tell() >= self.maxBytes:
+          f.close()
+          self.rotate()
+          f = open(self.path, 'a')
+      if stopping:
+        f.close()
+        return
+
+  def rotate(self):
+    name = os.path.join(self.directory, 'telemetry-%s.jsonl' % time.strftime('%Y%m%d-%H%M%S'))
+    while os.path.exists(name) or os.path.exists(name + '.gz'):
+      name = name[:-len('.jsonl')] + '-1.jsonl'
+    os.rename(self.path, name)
+    if self.compress:
+      with open(name, 'rb') as src, gzip.open(name + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+      os.remove(name)
+
+    rotated = sorted(glob.glob(os.path.join(self.directory, 'telemetry-*.jsonl*')),
+                     key = os.path.getmtime)
+    for old in rotated[:-self.backups]:
+      os.remove(old)
+
+  def close(self):
+    """
+      Write everything that is still buffered and stop the writer
+    """
+    if self.enabled and self.thread.is_alive():
+      self.stopping.set()
+      self.thread.join()
+
+class GameStats:
+  """
+    Per piece and per game figures of the game played by an engine
+  """
+  def __init__(self, telemetry, engine):
+    self.telemetry = telemetry
+    self.engine = engine
+    self.game = 0
+    self.start()
+
+  def start(self):
+    self.game += 1
+    self.spawnTick = self.engine.ticks
+    self.shape = self.engine.current.shape
+    # Ticks from spawn to lock (these rules have no lock delay, so this is the time spent falling)
+    self.pieceTicks = 0
+    self.clears = {}
+    self.timeline = [[0, 0]]
+    self.frameBuckets = [0] * (len(FRAME_BUCKETS) + 1)
+    self.lastFrame = None
+
+  def step(self, result):
+    """
+      Record the outcome of an engine step
+    """
+    if not self.telemetry.enabled or not result.locked:
+      return
+    engine = self.engine
+    # The engine has already spawned the next tetromino
+    (shape, self.shape) = (self.shape, engine.current.shape)
+    pieceTicks = engine.ticks - self.spawnTick
+    self.spawnTick = engine.ticks
+    self.pieceTicks += pieceTicks
+    if result.cleared:
+      size = len(result.cleared)
+      self.clears[size] = self.clears.get(size, 0) + 1
+    seconds = engine.ticks // TICK_RATE
+    if seconds - self.timeline[-1][0] >= TIMELINE_STEP:
+      self.timeline.append([seconds, engine.score])
+
+    self.telemetry.emit('piece', game = self.game, n = engine.pieces - 1, shape = shape,
+                        pieceTicks = pieceTicks, cleared = len(result.cleared), score = engine.score)
+
+  def frame(self):
+    """
+      Called once per presented frame
+    """
+    if not self.telemetry.enabled:
+      return
+    now = time.perf_counter()
+    if self.lastFrame is not None:
+      self.frameBuckets[bisect_right(FRAME_BUCKETS, (now - self.lastFrame) * 1000)] += 1
+    self.lastFrame = now
+
+  def finish(self, **fields):
+    """
+      Emit the summary of the game that has just ended
+    """
+    engine = self.engine
+    seconds = engine.ticks / TICK_RATE
+    # The falling (or topped out) tetromino is not counted, like in the piece events
+    locked = engine.pieces - 1
+    buckets = ['<%d' % b for b in FRAME_BUCKETS] + ['>=%d' % FRAME_BUCKETS[-1]]
+    self.telemetry.emit('game', game = self.game, seed = engine.seed, duration = seconds,
+                        pieces = locked, piecesPerSecond = locked / max(seconds, 1),
+                        meanPieceTicks = self.pieceTicks / max(locked, 1), lines = engine.lines,
+                        clears = self.clears, score = engine.score,
+                        timeline = self.timeline + [[int(seconds), engine.score]],
+                        frameMs = dict(zip(buckets, self.frameBuckets)), topOut = engine.topOut,
+                        **fields)
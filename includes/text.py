@@ -0,0 +1,66 @@
+# Cache of rendered text so that the HUD does not rasterize the same strings on every frame
+import pygame
+from collections import OrderedDict
+
+class TextCache:
+  """
+    Rendered text surfaces keyed by (text, color, size); the least recently used ones are evicted
+    Numbers (and the HH:MM:SS time) are composed from pre-rendered digit glyphs
+  """
+  digits = '0123456789:'
+
+  def __init__(self, font, capacity = 64):
+    self.font = font
+    self.capacity = capacity
+    self.surfaces = OrderedDict()
+    self.glyphs = {}
+
+  def glyph(self, char, color):
+    """
+      Rendered surface, rect and horizontal advance of a single character
+    """
+    key = (char, tuple(color), self.font.size)
+    if key not in self.glyphs:
+      (surface, rect) = self.font.render(char, color)
+      advance = self.font.get_metrics(char)[0][4]
+      self.glyphs[key] = (surface, rect, advance)
+    return self.glyphs[key]
+
+  def compose(self, text, color):
+    """
+      Build the surface of a number by blitting its digit glyphs next to each other
+    """
+    glyphs = [self.glyph(char, color) for char in text]
+    left = glyphs[0][1].x
+    top = max(rect.y for (_, rect, _) in glyphs)
+
+    pen = 0
+    placed = []
+    for (surface, rect, advance) in glyphs:
+      placed.append((surface, (pen + rect.x - left, top - rect.y)))
+      pen += advance
+
+    width = max(x + surface.get_width() for (surface, (x, _)) in placed)
+    height = max(y + surface.get_height() for (surface, (_, y)) in placed)
+    output = pygame.Surface((round(width), height), pygame.SRCALPHA)
+    output.blits(placed, doreturn = False)
+    return (output, pygame.Rect(left, top, output.get_width(), height))
+
+  def render(self, text, color):
+    """
+      Same as Font.render but the result is cached
+    """
+    key = (text, tuple(color), self.font.size)
+    if key in self.surfaces:
+      self.surfaces.move_to_end(key)
+      return self.surfaces[key]
+
+    if text and all(char in TextCache.digits for char in text):
+      rendered = self.compose(text, color)
+    else:
+      rendered = self.font.render(text, color)
+
+    self.surfaces[key] = rendered
+    if len(self.surfaces) > self.capacity:
+      self.surfaces.popitem(last = False)
+    return rendered
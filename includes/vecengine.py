@@ -0,0 +1,260 @@
+# Many games of tetris stepped at once; the state of every game lives in NumPy arrays so that
+# moves, collision tests, line detection and gravity are array operations across all boards
+# The rules are the same as the ones in includes/engine.py
+import random
+import numpy as np
+from includes.pieces import Stream, PieceQueue, CHUNK
+from includes.engine import (ACTIONS, LEFT, RIGHT, ROTATE, DOWN, SOFT_DROP, HARD_DROP, COLORS,
+                             SHAPE_NAMES, ORIENTATIONS, EXTENTS, spawnCols)
+
+# Action codes are indices into ACTIONS
+ACTION_CODES = {action: i for (i, action) in enumerate(ACTIONS)}
+
+# Shape tables indexed by the position of the shape in SHAPE_NAMES
+SHAPE_ORIENTATIONS = np.array([ORIENTATIONS[name] for name in SHAPE_NAMES], dtype = np.int64)
+SHAPE_EXTENTS = np.array([EXTENTS[name] for name in SHAPE_NAMES], dtype = np.int64)
+
+class VecEngine:
+  """
+    n games of tetris with one row of the map above the visible area (where the tetrominos
+    spawn), so the default boards array is n x 24 x 12
+    Cells hold 0 when empty or the index of the color in COLORS + 1
+    Every board deals its tetrominos from its own stream split off the seed, so a board does not
+    depend on the others; the g-th game of board i has the seed seeds[i] and plays like Engine
+    with that seed
+  """
+  def __init__(self, n, seed = None, width = 12, height = 23):
+    self.n = n
+    self.width = width
+    self.height = height
+    self.hidden = 1
+    if seed is None:
+      seed = random.getrandbits(64)
+    self.streams = [Stream(seed).split(i) for i in range(n)]
+    self.seeds = np.zeros(n, dtype = np.uint64)
+    self.games = np.zeros(n, dtype = np.int64)
+    cols = spawnCols(width)
+    self.spawnCols = [cols[name] for name in SHAPE_NAMES]
+    # The queues deal shape and color indices; their tetrominos are copied CHUNK at a time into
+    # upcoming, drawn is the position in it of the next one of every board
+    self.queues = [None] * n
+    self.upcoming = np.zeros((n, CHUNK, 3), dtype = np.int64)
+    self.drawn = np.zeros(n, dtype = np.int64)
+    self.boards = np.zeros((n, height + self.hidden, width), dtype = np.uint8)
+    self.squares = np.zeros((n, 4, 2), dtype = np.int64)
+    # Orientation of every tetromino and the cell its offsets start from
+    self.rotations = np.zeros(n, dtype = np.int64)
+    self.origins = np.zeros((n, 2), dtype = np.int64)
+    self.shapes = np.zeros(n, dtype = np.int64)
+    self.colors = np.zeros(n, dtype = np.int64)
+    self.nextShapes = np.zeros(n, dtype = np.int64)
+    self.nextColors = np.zeros(n, dtype = np.int64)
+    self.nextCols = np.zeros(n, dtype = np.int64)
+    self.score = np.zeros(n, dtype = np.int64)
+    self.lines = np.zeros(n, dtype = np.int64)
+    self.pieces = np.zeros(n, dtype = np.int64)
+    self.gameOver = np.zeros(n, dtype = bool)
+    self.rows = np.arange(n)[:, None]
+    self.reset()
+
+  def observe(self):
+    """
+      Visible part of every board; this is a view of the state, not a copy
+    """
+    return self.boards[:, self.hidden:]
+
+  def reset(self, mask = None):
+    """
+      Start new games on the boards selected by the boolean mask (all of them by default)
+    """
+    if mask is None:
+      mask = np.ones(self.n, dtype = bool)
+    # A copy, so that e.g. reset(games.gameOver) still knows the boards after gameOver is cleared
+    mask = np.array(mask, dtype = bool)
+    self.boards[mask] = 0
+    self.score[mask] = 0
+    self.lines[mask] = 0
+    self.pieces[mask] = 0
+    self.gameOver[mask] = False
+    for i in np.flatnonzero(mask):
+      self.seeds[i] = self.streams[i].value(int(self.games[i]))
+      self.games[i] += 1
+      self.queues[i] = PieceQueue(int(self.seeds[i]), range(len(SHAPE_NAMES)),
+                                  range(len(COLORS)), self.spawnCols)
+    self.drawn[mask] = CHUNK
+    self.randomNext(mask)
+    self.spawn(mask)
+
+  def randomNext(self, mask):
+    """
+      Take the next tetris element (color, shape and starting column) of the selected boards from
+      their queues
+    """
+    for i in np.flatnonzero(mask & (self.drawn == CHUNK)):
+      self.upcoming[i] = [self.queues[i].pop() for _ in range(CHUNK)]
+      self.drawn[i] = 0
+    boards = np.flatnonzero(mask)
+    (self.nextShapes[boards], self.nextColors[boards], self.nextCols[boards]) = \
+      self.upcoming[boards, self.drawn[boards]].T
+    self.drawn[boards] += 1
+
+  def spawn(self, mask):
+    """
+      The next elements become the current ones on the selected boards
+      If an element cannot move at all when it appears, that game is over
+    """
+    shapes = self.nextShapes[mask]
+    cols = self.nextCols[mask]
+    self.shapes[mask] = shapes
+    self.colors[mask] = self.nextColors[mask]
+    squares = SHAPE_ORIENTATIONS[shapes, 0].copy()
+    squares[:, :, 0] += cols[:, None]
+    self.squares[mask] = squares
+    self.rotations[mask] = 0
+    self.origins[mask, 0] = cols
+    self.origins[mask, 1] = 0
+    self.pieces[mask] += 1
+    self.randomNext(mask)
+
+    blocked = ~self.fits(self.squares) | self.isResting()
+    self.gameOver |= mask & blocked
+
+  def occupied(self, squares):
+    """
+      (n, 4) array telling which squares are taken by fixed blocks
+      Squares outside of the board are considered free
+    """
+    cols = squares[:, :, 0]
+    rows = squares[:, :, 1] + self.hidden
+    inside = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.boards.shape[1])
+    taken = self.boards[self.rows, np.clip(rows, 0, self.boards.shape[1] - 1),
+                        np.clip(cols, 0, self.width - 1)] != 0
+    return inside & taken
+
+  def fits(self, squares):
+    """
+      Check that the squares are within the map and do not collide with fixed blocks
+    """
+    cols = squares[:, :, 0]
+    rows = squares[:, :, 1]
+    inside = (cols >= 0) & (cols < self.width) & (rows < self.height)
+    return (inside & ~self.occupied(squares)).all(axis = 1)
+
+  def isResting(self):
+    """
+      Check which of the current tetrominos reached the bottom of the map or another tetromino
+    """
+    below = self.squares.copy()
+    below[:, :, 1] += 1
+    atBottom = (self.squares[:, :, 1] == self.height - 1).any(axis = 1)
+    return atBottom | self.occupied(below).any(axis = 1)
+
+  def dropDistance(self, mask):
+    """
+      How many rows the tetrominos of the selected boards can fall before they hit a block or the
+      bottom of the map, found for all of them at once from the first occupied row below every
+      square in its column
+    """
+    boards = self.boards[mask]
+    total = boards.shape[1]
+    # firstBelow[b, r, c] is the first occupied row at or after r in column c (total if none); the
+    # extra row at the end stands for the bottom of the map
+    heights = np.arange(total + 1)[None, :, None]
+    rows = np.where(np.pad(boards != 0, ((0, 0), (0, 1), (0, 0)), constant_values = True),
+                    heights, total)
+    firstBelow = np.minimum.accumulate(rows[:, ::-1], axis = 1)[:, ::-1]
+
+    cols = self.squares[mask, :, 0]
+    starts = self.squares[mask, :, 1] + self.hidden
+    below = firstBelow[np.arange(len(boards))[:, None], np.clip(starts + 1, 0, total), cols]
+    return (below - starts - 1).min(axis = 1)
+
+  def rotated(self):
+    """
+      Squares of the tetrominos in their next orientation (looked up in the rotation tables),
+      shifted back into the map at the sides
+    """
+    rotations = (self.rotations + 1) % 4
+    extents = SHAPE_EXTENTS[self.shapes, rotations]
+    left = self.origins[:, 0] + extents[:, 0]
+    right = self.origins[:, 0] + extents[:, 1]
+    dx = np.where(left < 0, -left, np.where(right >= self.width, self.width - 1 - right, 0))
+    squares = SHAPE_ORIENTATIONS[self.shapes, rotations] + self.origins[:, None, :]
+    squares[:, :, 0] += dx[:, None]
+    return [squares, dx]
+
+  def step(self, actions):
+    """
+      Apply one action per board; actions is an array of codes (see ACTION_CODES)
+      Returns the points gained and the number of cleared rows on every board
+    """
+    actions = np.asarray(actions)
+    active = ~self.gameOver
+    dx = np.zeros(self.n, dtype = np.int64)
+    dy = np.zeros(self.n, dtype = np.int64)
+    dx[actions == ACTION_CODES[LEFT]] = -1
+    dx[actions == ACTION_CODES[RIGHT]] = 1
+    falling = (actions == ACTION_CODES[DOWN]) | (actions == ACTION_CODES[SOFT_DROP])
+    dy[falling] = 1
+
+    hard = active & (actions == ACTION_CODES[HARD_DROP])
+    if hard.any():
+      dy[hard] = self.dropDistance(hard)
+
+    candidates = self.squares.copy()
+    candidates[:, :, 0] += dx[:, None]
+    candidates[:, :, 1] += dy[:, None]
+
+    # The rotation is not allowed at the top of the map
+    rotating = (actions == ACTION_CODES[ROTATE]) & (self.squares[:, :, 1] > 0).all(axis = 1)
+    (rotatedSquares, shift) = self.rotated()
+    candidates[rotating] = rotatedSquares[rotating]
+    dx[rotating] = shift[rotating]
+
+    moving = active & ((dx != 0) | (dy != 0) | rotating)
+    accepted = moving & self.fits(candidates)
+    self.squares[accepted] = candidates[accepted]
+    self.origins[accepted, 0] += dx[accepted]
+    self.origins[accepted, 1] += dy[accepted]
+    self.rotations[accepted & rotating] = (self.rotations[accepted & rotating] + 1) % 4
+
+    points = np.zeros(self.n, dtype = np.int64)
+    points[active & (actions == ACTION_CODES[SOFT_DROP])] += 1
+    points[hard] += 2 * dy[hard]
+
+    # A tetromino that cannot fall any further is fixed immediately
+    locking = active & self.isResting()
+    cleared = np.zeros(self.n, dtype = np.int64)
+    if locking.any():
+      cleared = self.lock(locking)
+      points += cleared * (cleared - 1) * 100
+
+    self.score += points
+    return [points, cleared]
+
+  def lock(self, mask):
+    """
+      Fix the tetrominos of the selected boards, clear the filled rows and spawn the next elements
+      Returns the number of cleared rows on every board
+    """
+    boardIds = np.broadcast_to(self.rows, (self.n, 4))[mask].ravel()
+    cols = self.squares[mask, :, 0].ravel()
+    rows = self.squares[mask, :, 1].ravel() + self.hidden
+    colors = np.repeat(self.colors[mask] + 1, 4).astype(np.uint8)
+    stored = rows >= 0
+    self.boards[boardIds[stored], rows[stored], cols[stored]] = colors[stored]
+
+    # Full rows are moved to the top by a stable sort and emptied, the others fall down
+    full = (self.boards != 0).all(axis = 2) & mask[:, None]
+    cleared = full.sum(axis = 1)
+    clearing = cleared > 0
+    if clearing.any():
+      order = np.argsort(~full[clearing], axis = 1, kind = 'stable')
+      compacted = np.take_along_axis(self.boards[clearing], order[:, :, None], axis = 1)
+      heights = np.arange(self.boards.shape[1])[None, :]
+      compacted[heights < cleared[clearing][:, None]] = 0
+      self.boards[clearing] = compacted
+      self.lines += cleared
+
+    self.spawn(mask)
+    return cleared
@@ -1,81 +1,330 @@
-import sys, pygame, pygame.freetype, time, math, random, re
+import sys, os, atexit, pygame, pygame.freetype, time, random
 from includes.constants import * 
 from includes.helpers import *
 from includes.elements import *
+from includes.engine import *
+from includes.board import Board
+from includes.scheduler import Scheduler, FrameBudget
+from includes.animations import Animations
+from includes.text import TextCache
+from includes.scores import ScoreStore
+from includes.bots import PlannerBot
+from includes.replay import ReplayRecorder
+from includes.profiler import Profiler
+from includes.assets import Assets
+from includes.controls import Controls, allowEvents, SHIFTS, REDRAW_EVENTS
+from includes.telemetry import Telemetry, GameStats
+from includes.capture import FrameCapture
+
+# Only the subsystems that are used are initialized
+pygame.display.init()
+pygame.freetype.init()
+pygame.mixer.init()
+
+# Images and sounds are decoded in the background while the window and the HUD are set up
+assets = Assets()
+assets.preload(['sprites/bgImage.png'] + SpriteAtlas.paths() +
+               ['sounds/success.wav', 'sounds/gameover.wav'])
+musicLoaded = False
 
-pygame.init()
 pygame.display.set_caption('Retro Tetris')
+GAME_FONT = pygame.freetype.Font('fonts/classic.TTF', 14)
 
-startTime = time.time()
+# Every HUD string is rasterized once and reused until it is evicted
+texts = TextCache(GAME_FONT)
+
+# Text currently shown on the HUD, it is only redrawn when it changes, and the music fade in
+hud = {'time': None, 'volume': 0, 'fadeStart': 0}
+
+# The background music fades in to this volume over a second at the start of every game
+MUSIC_VOLUME = 0.5
+
+# Cells of the ghost piece that shows where the current element would land (TETRIS_GHOST=0 hides it)
+SHOW_GHOST = os.environ.get('TETRIS_GHOST', '1') != '0'
+ghostCells = []
+
+# Rows the engine has cleared that are still shown while they flash (see startClear); the map is
+# only scrolled once the animation is over, until then the current element is not drawn
+clearing = {}
+
+# Name under which the games are saved in the score history
+PLAYER = os.environ.get('TETRIS_PLAYER', 'player')
+
+# Every game is recorded into this directory when it is set (see replay.py)
+REPLAY_DIR = os.environ.get('TETRIS_REPLAY_DIR')
+recorder = None
+
+# When set, the phases of every frame are measured, shown in an overlay (toggled with F3) and
+# written to this file as a Chrome trace on exit
+PROFILE_PATH = os.environ.get('TETRIS_PROFILE')
+profiler = Profiler(enabled = bool(PROFILE_PATH))
+if PROFILE_PATH:
+  atexit.register(profiler.dump, PROFILE_PATH)
+# Seconds between two refreshes of the profiler overlay
+OVERLAY_INTERVAL = 0.5
+
+def msToTicks(ms):
+  return round(float(ms) * TICK_RATE / 1000)
+
+# Delayed auto-shift and auto-repeat rate of the arrows in milliseconds; with TETRIS_INPUT_LAG set
+# the latency from reading a key press to presenting its first frame is reported on exit
+controls = Controls(das = msToTicks(os.environ.get('TETRIS_DAS', 167)),
+                    arr = msToTicks(os.environ.get('TETRIS_ARR', 33)),
+                    measure = bool(os.environ.get('TETRIS_INPUT_LAG')))
+
+def reportInputLag():
+  report = controls.report()
+  if report:
+    (count, window) = (report.pop('count'), report.pop('window'))
+    print('input latency of the last %d of %d presses (ms): ' % (window, count) +
+          ', '.join('%s %.1f' % (k, v) for (k, v) in report.items()), file = sys.stderr)
+
+if controls.measure:
+  atexit.register(reportInputLag)
 
 def displayText(text, color, pos):
-  textSurface, rect = GAME_FONT.render(text, color)
+  textSurface, rect = texts.render(text, color)
   screen.fill(pygame.Color("black"), (pos[0], pos[1], rect.width, rect.height))
   screen.blit(textSurface, pos) 
+  dirty.add((pos[0], pos[1], rect.width, rect.height))
+  dirty.add(textSurface.get_rect().move(pos))
   return (textSurface, rect)
 
 def updateTime(color, pos):
-  elapsedTimeInSecs = math.floor(time.time() - startTime)
+  elapsedTimeInSecs = engine.ticks // TICK_RATE
   formattedTime = formatSec(elapsedTimeInSecs) 
+  if formattedTime == hud['time']:
+    return
+  hud['time'] = formattedTime
   screen.fill(pygame.Color("black"), (35, 50, 75, 18))
-  newTextSurface, rect = GAME_FONT.render(formattedTime, color)
+  newTextSurface, rect = texts.render(formattedTime, color)
   screen.blit(newTextSurface, pos) 
+  dirty.add((35, 50, 75, 18))
+  dirty.add(newTextSurface.get_rect().move(pos))
 
-def moveBlockX(currentElement, d):
+def drawElement(element):
+  for sq in element:
+    sq.draw(batch)
+
+def drawGhost(cells, index):
   """
-    Shift the current element horizontally by 1 unit
-    Also make sure that the rotation does not place the element out of the map
+    Move the ghost of the current element (where it would land) to the given cells
   """
-  # If element is at the very right/left of the map do not allow further X-shift in that dir.
-  for sq in currentElement:
-    if (d == 'l' and sq.pos.left == 150) or (d == 'r' and sq.pos.left == 425):
-      return
+  for cell in ghostCells:
+    Game.eraseCell(cell, batch, background)
+  ghostCells[:] = cells if SHOW_GHOST else []
+  for cell in ghostCells:
+    batch.blit(SpriteAtlas.surface, cellPos(cell), SpriteAtlas.ghosts[index])
 
-  for sq in currentElement:
-    screen.blit(background, sq.pos, (150, 0, 26, 26))
+def moveElement(element, cells, ghost = []):
+  """
+    Move the sprites of the current element and its ghost to the given cells
+  """
+  for sq in element:
+    Game.eraseCell(sq.cell, batch, background)
+  drawGhost(ghost, element[0].index)
 
-  for sq in currentElement:
-    sq.moveHorizontally(d)
-    screen.blit(sq.image, sq.pos)
+  for (sq, cell) in zip(element, cells):
+    sq.moveTo(cell)
+    sq.draw(batch)
 
-def rotateElement(element):
+def redrawCells(cells):
   """
-    Rotate 90 deg each square that the tetris element is made up of around a pivot point
-    The point is the center of the bounding box
+    Draw the given cells of the map from the state of the game
   """
-  # Make sure that the rotation will not place the tetromino out of map at the top
-  for sq in element:
-    if sq.pos[1] <= 0:
-      return
-  
-  for sq in element:
-    screen.blit(background, sq.pos, (150, 0, 26, 26))
-  
-  # Also, make sure that element stays within the map after rotation
-  tmpArr = []
-  for sq in element:
-    sq.rotate()
-    tmpArr.append(sq.pos.left)
-
-  leftmostElement = min(tmpArr)
-  rightmostElement = max(tmpArr)
-  if leftmostElement < 150:
-    xShift = 150 - leftmostElement
-  elif rightmostElement > 425:
-    xShift = 425 - rightmostElement
-  else:
-    xShift = 0
-  
-  for sq in element:
-    sq.pos.left += xShift
-    screen.blit(sq.image, sq.pos)
+  board = engine.board
+  piece = engine.current.squares
+  index = SpriteAtlas.index(engine.current.color)
+  for cell in cells:
+    (col, row) = cell
+    if not (0 <= col < board.width and 0 <= row < board.height):
+      continue
+    # Sprites do not cover the whole cell
+    Game.eraseCell(cell, batch, background)
+    if cell in piece:
+      batch.blit(SpriteAtlas.surface, cellPos(cell), SpriteAtlas.areas[index])
+    elif cell in ghostCells:
+      batch.blit(SpriteAtlas.surface, cellPos(cell), SpriteAtlas.ghosts[index])
+    elif board.get(col, row):
+      batch.blit(SpriteAtlas.surface, cellPos(cell), SpriteAtlas.areas[board.get(col, row) - 1])
+
+def startClear(rows, trail, color):
+  """
+    Rows have been cleared by the engine: the map still shows them, with the element that filled
+    them, and keeps them on the screen while they flash
+    trail is the drop trail of the element (on the board as it is before the rows are removed), it
+    is shown once the map has been scrolled
+  """
+  board = engine.board
+  # Effects that painted over the map are stopped, the cells they covered are redrawn as they
+  # were before the clear (the cleared rows themselves have just been drawn by the lock)
+  for (col, row) in animations.cancel():
+    if 0 <= row < board.height and row not in rows:
+      Game.eraseCell((col, row), batch, background)
+      code = board.get(col, row + sum(1 for r in rows if r > row))
+      if code:
+        batch.blit(SpriteAtlas.surface, cellPos((col, row)), SpriteAtlas.areas[code - 1])
+  batch.flush()
+
+  # The board the map will show once the rows are gone
+  shown = Board(board.width, board.height, board.hidden)
+  shown.restore(board.copy())
+  rects = [pygame.Rect(MAP_RECT[0], row * CELL_SIZE, MAP_RECT[2], CELL_SIZE)
+           for row in rows if row >= 0]
+  clearing.update(rows = rows, board = shown, rects = rects,
+                  strips = [screen.subsurface(rect).copy() for rect in rects],
+                  trail = [(c, r + sum(1 for row in rows if row > r)) for (c, r) in trail],
+                  color = color)
+  animations.start(flashRows())
+
+def finishClear():
+  """
+    Remove the cleared rows from the screen; the current element is not drawn here
+  """
+  if not clearing:
+    return
+  Game.clearRows(clearing['board'], clearing['rows'], batch, background)
+  if clearing['trail']:
+    animations.start(dropTrail(clearing['trail'], clearing['color']))
+  clearing.clear()
+
+def flashRows(frames = 12):
+  """
+    Animation of cleared lines: the rows light up and fade out, then the map above them comes
+    down and the current element appears
+  """
+  for i in range(frames, 0, -1):
+    level = 160 * i // frames
+    for (rect, strip) in zip(clearing['rects'], clearing['strips']):
+      screen.blit(strip, rect)
+      screen.fill((level, level, level), rect, special_flags = pygame.BLEND_RGB_ADD)
+      dirty.add(rect)
+    yield
+  finishClear()
+  ghostCells[:] = engine.ghost() if SHOW_GHOST else []
+  redrawCells(set(engine.current.squares) | set(ghostCells))
+
+def dropTrail(cells, color, frames = 8):
+  """
+    Animation of a soft or hard drop: the cells the element fell through glow in its color
+  """
+  color = pygame.Color(color)
+  cells = [cell for cell in cells if cell[1] >= 0]
+  for i in range(frames, 0, -1):
+    redrawCells(cells)
+    batch.flush()
+    glow = [c * i // (2 * frames) for c in color[:3]]
+    for cell in cells:
+      if cell in engine.current.squares or cell in ghostCells or engine.board.get(*cell):
+        continue
+      rect = (cellPos(cell), (CELL_SIZE, CELL_SIZE))
+      screen.fill(glow, rect, special_flags = pygame.BLEND_RGB_ADD)
+    yield cells
+  redrawCells(cells)
+
+def gameOverAnimation():
+  """
+    Animation of the end of a game: the map fills up with grey from the bottom, then the game over
+    message is shown
+  """
+  (left, _, width, height) = MAP_RECT
+  step = max(BOARD_SIZE[1] // 24, 1)
+  for row in range(BOARD_SIZE[1], 0, -step):
+    top = max(row - step, 0)
+    rect = (left, top * CELL_SIZE, width, (row - top) * CELL_SIZE)
+    screen.fill(GRID, rect)
+    dirty.add(rect)
+    yield
+  displayGameOver()
+
+def applyAction(action, currentElement):
+  """
+    Let the engine apply an action to the current element and draw the outcome
+    Returns the result of the step and the sprites of the current element
+  """
+  if recorder:
+    recorder.record(action)
+  (squares, color) = (engine.current.squares, engine.current.color)
+  with profiler.span('gravity' if action in (DOWN, SOFT_DROP, HARD_DROP) else 'collision'):
+    result = engine.step(action)
+
+  # Every cell the squares of a dropped element passed through
+  trail = []
+  if action in (SOFT_DROP, HARD_DROP):
+    landed = result.locked or engine.current.squares
+    distance = landed[0][1] - squares[0][1]
+    trail = [(c, r + dy) for (c, r) in squares for dy in range(distance)
+             if (c, r + dy) not in landed]
+
+  if result.locked:
+    # Rows that are still flashing are removed before the lock is drawn
+    if clearing:
+      with profiler.span('rows'):
+        animations.cancel()
+        finishClear()
+    moveElement(currentElement, result.locked)
+    if result.cleared:
+      pygame.mixer.Channel(0).play(soundEffect('sounds/success.wav'))
+      with profiler.span('rows'):
+        startClear(result.cleared, trail, color)
+        trail = []
+
+    # The next element has been spawned by the engine, it is drawn once the rows are gone
+    currentElement = createElement(engine.current)
+    if not clearing:
+      drawGhost(engine.ghost(), currentElement[0].index)
+      drawElement(currentElement)
+    budget.defer('preview', displayPreview)
+  elif result.moved and clearing:
+    for (sq, cell) in zip(currentElement, engine.current.squares):
+      sq.moveTo(cell)
+  elif result.moved:
+    moveElement(currentElement, engine.current.squares, engine.ghost())
+
+  if trail and not clearing:
+    animations.start(dropTrail(trail, color))
+  return [result, currentElement]
+
+def drawProfiler():
+  """
+    Overlay with the frame time percentiles and the time of every phase (in ms)
+  """
+  screen.fill(pygame.Color("black"), (0, 330, 150, 245))
+  dirty.add((0, 330, 150, 245))
+  lines = profiler.overlayLines()[:9] + ['skipped %d' % sum(budget.skipped.values())]
+  for (i, line) in enumerate(lines):
+    displayText(line, WHITE, (10, 332 + i * 24))
 
-def displayNextElement(element):
+def startRecording():
+  """
+    Record the game that has just been started
+  """
+  global recorder
+  if REPLAY_DIR:
+    os.makedirs(REPLAY_DIR, exist_ok = True)
+    name = time.strftime('%Y%m%d-%H%M%S') + '-' + str(engine.seed) + '.replay'
+    recorder = ReplayRecorder(os.path.join(REPLAY_DIR, name), engine)
+
+def stopRecording():
+  global recorder
+  if recorder:
+    recorder.close()
+    recorder = None
+
+def displayPreview():
   """
-    Display the next element for the player
+    Display the next elements for the player, one below the other
   """
-  screen.fill(pygame.Color("black"), (455, 50, 140, 140))
+  area = (MAP_RIGHT + 5, 50, PANEL_WIDTH - 10, 100 * PREVIEW + 40)
+  screen.fill(pygame.Color("black"), area)
+  dirty.add(area)
+  for (slot, piece) in enumerate(engine.preview(PREVIEW)):
+    displayNextElement(createElement(piece), slot)
 
+def displayNextElement(element, slot = 0):
+  """
+    Display an upcoming element in the given slot of the preview
+  """
   # Position the element to the top right of the screen
   # Also make sure that the element is centered
   l = []
@@ -86,17 +335,17 @@ def displayNextElement(element):
   minMaxDiff = max(l) - min(l)
   
   # First shift the element to the very right of the map
-  diffCorrigated = 425 - max(l)
+  diffCorrigated = MAP_RIGHT - CELL_SIZE - max(l)
 
   # Then add margins to both sides so that it will be centered in the 150px region
-  diffCorrigated += 150 - (125 - minMaxDiff) / 2
+  diffCorrigated += PANEL_WIDTH - (PANEL_WIDTH - CELL_SIZE - minMaxDiff) / 2
 
   for i in range(len(element)):
-    element[i].pos = element[i].pos.move(diffCorrigated, 75)
-    screen.blit(element[i].image, element[i].pos)
+    element[i].pos = element[i].pos.move(diffCorrigated, 75 + slot * 100)
+    element[i].draw(batch)
 
 def getTextWidth(text):
-  hsTxt, _ = GAME_FONT.render(text, BLACK)
+  hsTxt, _ = texts.render(text, GOLD)
   return hsTxt.get_width()
 
 def updateScore(currentScore, highScore):
@@ -104,28 +353,23 @@ def updateScore(currentScore, highScore):
     Update current score and high score on the screen & also make sure they're centered
   """
   screen.fill(pygame.Color("black"), (10, 210, 130, 20))
+  dirty.add((10, 210, 130, 20))
   hsWidth = getTextWidth(str(highScore))
   hsPos = (150 - hsWidth) // 2, 210
   displayText(str(highScore), GOLD, hsPos)
 
   screen.fill(pygame.Color("black"), (10, 130, 130, 20))
+  dirty.add((10, 130, 130, 20))
   csWidth = getTextWidth(str(currentScore))
   csPos = (150 - csWidth) // 2, 130
   displayText(str(currentScore), GOLD, csPos)
 
-def getNextElements():
-  (nextShape, nextColor) = selectRandomElement(extra = True)
-  nextElementGroup = nextShape(nextColor, ex = False)
-  nextElement = nextElementGroup.squares
-  nextElementDisplay = nextShape(nextColor, ex = False).squares
-  return [nextElementGroup, nextElement, nextElementDisplay]
-
 def updateBothScores(currentScore, highScore, n):
   currentScore += n
   if currentScore > highScore:
     highScore = currentScore
-    updateHighScore(highScore)
-  updateScore(currentScore, highScore)
+    store.updateHighScore(highScore)
+  budget.defer('score', updateScore, currentScore, highScore)
   return [currentScore, highScore]
 
 def displayGameOver():
@@ -133,8 +377,8 @@ def displayGameOver():
     When the game is over clear the screen and display a game over message
   """
   screen.fill(pygame.Color('black'), (0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1]))
-  goText, rect1 = GAME_FONT.render('Game Over', WHITE)
-  paText, rect2 = GAME_FONT.render('Press [Enter] to play again', WHITE)
+  goText, rect1 = texts.render('Game Over', WHITE)
+  paText, rect2 = texts.render('Press [Enter] to play again', WHITE)
   width1 = goText.get_width()
   height1 = goText.get_height()
   width2 = paText.get_width()
@@ -145,18 +389,64 @@ def displayGameOver():
   posY2 = (SCREEN_SIZE[1] - height2) / 2 + 30
   screen.blit(goText, (posX1, posY1))
   screen.blit(paText, (posX2, posY2))
+  dirty.addAll()
 
 # Create display and set screen size
 screen = pygame.display.set_mode(SCREEN_SIZE)
-background = pygame.image.load('sprites/bgImage.png').convert()
+allowEvents()
+background = Game.mapBackground(assets.image('sprites/bgImage.png'))
+SpriteAtlas.load(assets)
+
+# TETRIS_CAPTURE records every presented frame: a directory gets PNG files, '|command' pipes raw
+# frames into the command and any other path gets the raw frames appended (see capture.py)
+CAPTURE_TARGET = os.environ.get('TETRIS_CAPTURE')
+capture = None
+if CAPTURE_TARGET:
+  capture = FrameCapture(screen, CAPTURE_TARGET,
+                         capacity = int(os.environ.get('TETRIS_CAPTURE_QUEUE', 120)))
+  atexit.register(capture.report)
+  atexit.register(capture.close)
+
+# Only the regions of the screen that changed during a frame are pushed to the display
+dirty = DirtyRegions(capture)
+
+# Blits of the blocks are collected during a frame and drawn at once
+batch = BlitBatch(screen, dirty)
+# TETRIS_BAG=1 deals the shapes in shuffled bags of seven, TETRIS_PREVIEW sets how many upcoming
+# elements are shown (1 to 5)
+engine = Engine(width = BOARD_SIZE[0], height = BOARD_SIZE[1],
+                bag = bool(os.environ.get('TETRIS_BAG')))
+engine.span = profiler.span
+PREVIEW = min(max(int(os.environ.get('TETRIS_PREVIEW', 1)), 1), 5)
+
+# Scores are kept in memory and written to disk in the background
+store = ScoreStore()
+atexit.register(store.close)
+atexit.register(stopRecording)
+
+# Per piece and per game telemetry is written to rotating JSONL files in TETRIS_TELEMETRY_DIR
+telemetry = Telemetry(os.environ.get('TETRIS_TELEMETRY_DIR'),
+                      maxBytes = int(float(os.environ.get('TETRIS_TELEMETRY_MB', 10)) * 2 ** 20),
+                      compress = bool(os.environ.get('TETRIS_TELEMETRY_GZIP')))
+atexit.register(telemetry.close)
+gameStats = GameStats(telemetry, engine)
+scheduler = Scheduler(TICK_RATE, FPS)
+# HUD text, the preview and the music fade are only drawn in frames that have time left for them;
+# TETRIS_FRAME_BUDGET is that time in ms (one frame at the FPS cap, or at 60 FPS when uncapped)
+budget = FrameBudget(float(os.environ.get('TETRIS_FRAME_BUDGET', 1000 / (FPS or 60))) / 1000)
+# Line clear, drop and game over effects, advanced once per frame
+animations = Animations()
+autoPlayer = PlannerBot()
 
 def graphicsInit():
   """
     Display graphical elements and text on the screen
   """
-  screen.blit(background, (round((SCREEN_SIZE[0] - 300) / 2), 0))
+  screen.blit(background, MAP_RECT[:2])
+  dirty.addAll()
+  hud['time'] = '00:00:00'
 
-  hsWidth = getTextWidth(str(getHighScore()))
+  hsWidth = getTextWidth(str(store.highScore))
   hsPos = (150 - hsWidth) // 2, 210
 
   # Initialize font, display elapsed time, current score and high score
@@ -165,155 +455,205 @@ def graphicsInit():
   (currentScoreLabel, x) = displayText('Current Score', WHITE, (10, 100))
   (cs, x) = displayText('0', GOLD, (70, 130))
   (highScoreLabel, x) = displayText('High Score', WHITE, (25, 180))
-  (highScore, x) = displayText(str(getHighScore()), GOLD, hsPos)
+  (highScore, x) = displayText(str(store.highScore), GOLD, hsPos)
   (linesLabel, x) = displayText('Lines', WHITE, (50, 260))
   (linesCount, x) = displayText('0', GOLD, (70, 290))
-  (nextLabel, x) = displayText('Next', WHITE, (500, 20))
+  (nextLabel, x) = displayText('Next', WHITE, (MAP_RIGHT + 50, 20))
 
 graphicsInit()
 
 def soundInit():
   """
-    Initialize sounds, set volumes
+    Start the background music; it is only loaded the first time, restarts just play it again
   """
+  global musicLoaded
+  if not musicLoaded:
+    pygame.mixer.music.load('sounds/bgMusic.mp3')
+    musicLoaded = True
+
+  hud['volume'] = 0
+  hud['fadeStart'] = time.monotonic()
+  pygame.mixer.music.set_volume(0)
+
   # Play background music forever
-  pygame.mixer.music.set_volume(0.5)
-  pygame.mixer.music.load('sounds/bgMusic.mp3')
   pygame.mixer.music.play(-1)
 
-  lineSound = pygame.mixer.Sound('sounds/success.wav')
-  lineSound.set_volume(0.9)
-  gameOverSound = pygame.mixer.Sound('sounds/gameover.wav')
-  gameOverSound.set_volume(0.9)
-  return [lineSound, gameOverSound]
- 
-lineSound, gameOverSound = soundInit()
+def rampMusic():
+  # The fade follows the clock, so it takes a second whatever the frame rate
+  hud['volume'] = min((time.monotonic() - hud['fadeStart']) * MUSIC_VOLUME, MUSIC_VOLUME)
+  pygame.mixer.music.set_volume(hud['volume'])
+
+def soundEffect(path):
+  """
+    Sound effect decoded in the background at startup, with its volume set
+  """
+  sound = assets.sound(path)
+  sound.set_volume(0.9)
+  return sound
 
 def main():
   """
     Main event loop of the game
   """
 
-  prevMoveSec = 0
-  precision = 0
+  autoPlay = False
+  showProfiler = profiler.enabled
+  lastOverlay = 0
   currentScore = 0 
-  lines = 0
   gameOver = False
-  highScore = getHighScore()
-  currentElementGroup = selectRandomElement()
-  currentElement = currentElementGroup.squares
-
-  (nextElementGroup, nextElement, nextElementDisplay) = getNextElements()
-
-  # Move the image of the next element to the top right corner
-  displayNextElement(nextElementDisplay)
+  highScore = store.highScore
+  currentElement = createElement(engine.current)
+  drawGhost(engine.ghost(), currentElement[0].index)
+  drawElement(currentElement)
+
+  # Move the image of the next elements to the top right corner
+  displayPreview()
+
+  # Show the first frame before the music is loaded
+  batch.flush()
+  dirty.update()
+  soundInit()
+  startRecording()
+  scheduler.reset()
   while True:
+    budget.begin()
     if not gameOver:
-      posBefore = []
-      for sq in currentElement:
-        posBefore.append((sq.pos[0], sq.pos[1]))
-
-      for event in pygame.event.get():
+      with profiler.span('events'):
+        events = pygame.event.get()
+      for event in events:
         if event.type == pygame.QUIT:
           sys.exit()
+        if event.type in REDRAW_EVENTS:
+          dirty.addAll()
+          continue
 
-        # Handle keyboard events
+        # Arrows move, rotate and speed up the falling of the current element, space drops it
+        if controls.read(event):
+          continue
         if event.type == pygame.KEYDOWN:
-          # Move the current element left/right by one unit (if not already at the sides)
-          if (event.key == pygame.K_LEFT and
-            not checkCollision(currentElement, Game.tetrominos.copy(), -25, 0)):
-            moveBlockX(currentElement, 'l')
-          elif (event.key == pygame.K_RIGHT and not checkCollision(currentElement,
-            Game.tetrominos.copy(), 25, 0)):
-            moveBlockX(currentElement, 'r')
-          # Rotate the current element in clockwise direction
-          elif (event.key == pygame.K_UP and not checkCollision(currentElement,
-            Game.tetrominos.copy(), 0, 0, rotate = True)):
-            rotateElement(currentElement)
-          # Speed up the falling of a tetromino
-          elif event.key == pygame.K_DOWN:
-            precision = 1
-        elif event.type == pygame.KEYUP:
-          if event.key == pygame.K_DOWN:
-            precision = 0
-
-      eTime = round(time.time() - startTime, precision)
-      
-      # At every second move current tetromino down by 1 unit
-      if eTime > prevMoveSec:
-        if precision:
-          currentScore, highScore = updateBothScores(currentScore, highScore, 1)
-          
-        for sq in currentElement:
-          screen.blit(background, sq.pos, (150, 0, 26, 26))
-        
-        for sq in currentElement:
-          sq.move()
-          screen.blit(sq.image, sq.pos)
-        
-        # Check if there is a filled row
-        posYs = Game.checkForRows()
-        if posYs and currentElementGroup.didCollide():
-          pygame.mixer.Channel(0).play(lineSound)
-          Game.clearRow(posYs, screen, background) 
-          Game.shiftRows(posYs, screen, background)
-
-          # Update number of filled lines and current score
-          lines += len(posYs)
-          displayText(str(lines), GOLD, (70, 290))  
-          
-          n = len(posYs) * (len(posYs) - 1) * 100
-          currentScore, highScore = updateBothScores(currentScore, highScore, n)
-
-        prevMoveSec = eTime
-   
-      # Check if the current tetromino reached the bottom of the map
-      if currentElementGroup.didCollide():
-        # Check for game end: if the player cannot move the current element anymore
-        posAfter = []
-        for sq in currentElement:
-          posAfter.append((sq.pos[0], sq.pos[1]))
-          
+          # Let the computer play (demo mode)
+          if event.key == pygame.K_a:
+            autoPlay = not autoPlay
+          elif event.key == pygame.K_F3 and profiler.enabled:
+            showProfiler = not showProfiler
+            screen.fill(pygame.Color("black"), (0, 330, 150, 245))
+            dirty.add((0, 330, 150, 245))
+
+      # Key presses are applied right away, held arrows repeat at the logic ticks
+      ticks = scheduler.dueTicks()
+      actions = [(press.action, press) for press in controls.poll(ticks, engine.pieces)]
+      if autoPlay and ticks:
+        action = autoPlayer(engine, random)
+        if action:
+          actions.append((action, None))
+
+      # Gravity moves the current tetromino down by 1 unit when enough logic ticks have passed
+      for _ in range(ticks):
+        gravity = engine.tick(controls.softDrop)
+        if gravity:
+          actions.append((gravity, None))
+
+      i = 0
+      while i < len(actions):
+        (action, press) = actions[i]
+        i += 1
+        # The held arrow moves the tetromino up to the wall (or until it locks); the refused move
+        # is not applied
+        if press and press.toWall and not engine.fits(engine.current.shifted(SHIFTS[action], 0)):
+          continue
+        (result, currentElement) = applyAction(action, currentElement)
+        if press and press.toWall and not result.locked:
+          actions.insert(i, (action, press))
+        if press:
+          atTop = any(r <= 0 for (_, r) in engine.current.squares)
+          controls.applied(press, result, engine.pieces, atTop)
+        gameStats.step(result)
+        if result.cleared:
+          # Update number of filled lines
+          budget.defer('lines', displayText, str(engine.lines), GOLD, (70, 290))
+
+        if result.points:
+          currentScore, highScore = updateBothScores(currentScore, highScore, result.points)
+
         # Game over, reset states
-        if posAfter == posBefore:
-          pygame.mixer.Sound.play(gameOverSound)
+        if engine.gameOver:
+          store.recordGame(PLAYER, currentScore, engine.lines, engine.ticks // TICK_RATE)
+          gameStats.finish(player = PLAYER, bag = engine.bag, skipped = budget.skipped)
+          # The HUD that is still waiting would be drawn over the game over screen
+          budget.clear()
+          stopRecording()
+          pygame.mixer.Sound.play(soundEffect('sounds/gameover.wav'))
           pygame.mixer.music.stop()
-          Game.tetrominos = []
-          displayGameOver()
+          animations.cancel()
+          animations.start(gameOverAnimation())
+          batch.flush()
+          dirty.update()
           gameOver = True
-        
-        if not gameOver:
-          currentElementGroup = nextElementGroup
-          currentElement = currentElementGroup.squares
-          (nextElementGroup, nextElement, nextElementDisplay) = getNextElements()
-          displayNextElement(nextElementDisplay)
-          Game.tetrominos.extend(currentElement)
-
-      if not gameOver:
-        updateTime(GOLD, (35, 50))
-
-      pygame.display.update()
+          break
+
+      if not gameOver and scheduler.frameDue():
+        budget.defer('time', updateTime, GOLD, (35, 50))
+        # Timed by the clock, several logic ticks can pass in one iteration of the loop
+        if showProfiler and time.perf_counter() - lastOverlay >= OVERLAY_INTERVAL:
+          lastOverlay = time.perf_counter()
+          budget.defer('profiler', drawProfiler)
+        if hud['volume'] < MUSIC_VOLUME:
+          budget.defer('music', rampMusic)
+        with profiler.span('hud'):
+          budget.run()
+        with profiler.span('animations'):
+          animations.step()
+        with profiler.span('display'):
+          batch.flush()
+          dirty.update()
+        budget.end()
+        controls.presented()
+        profiler.frame()
+        gameStats.frame()
+
+      scheduler.idle()
     else:
       # Listen for [Enter] -> play again
       # Also reset states
-      for event in pygame.event.get(): 
-        if event.type == pygame.KEYDOWN:
-          if event.type == pygame.QUIT:
-            sys.exit()
-
-          if event.key == pygame.K_RETURN:
-            gameOver = False
-            prevMoveSec = 0
-            precision = 0
-            currentScore = 0 
-            lines = 0
-            graphicsInit()
-            currentElementGroup = selectRandomElement()
-            currentElement = currentElementGroup.squares
-            (nextElementGroup, nextElement, nextElementDisplay) = getNextElements()
-            displayNextElement(nextElementDisplay)
-
-            soundInit()
+      # Events are only waited for once the game over animation has finished
+      events = pygame.event.get() if animations else [pygame.event.wait()]
+      restart = False
+      for event in events:
+        if event.type == pygame.QUIT:
+          sys.exit()
+
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
+          restart = True
+        elif event.type in REDRAW_EVENTS:
+          dirty.addAll()
+          dirty.update()
+
+      if not restart:
+        if animations:
+          scheduler.dueTicks()
+          if scheduler.frameDue():
+            animations.step()
+            batch.flush()
+            dirty.update()
+          scheduler.idle()
+        continue
+
+      gameOver = False
+      animations.cancel()
+      clearing.clear()
+      controls.reset()
+      currentScore = 0 
+      graphicsInit()
+      engine.reset()
+      gameStats.start()
+      currentElement = createElement(engine.current)
+      drawGhost(engine.ghost(), currentElement[0].index)
+      drawElement(currentElement)
+      displayPreview()
+
+      soundInit()
+      startRecording()
+      scheduler.reset()
 
 if __name__ == '__main__':
   tetris = main() 
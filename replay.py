@@ -0,0 +1,54 @@
+# Play a recorded game back at unlimited speed, e.g. to check a high score claim
+#   python replay.py replays/game.replay
+#   python replay.py replays/game.replay --tick 3600   (board one minute into the game)
+import argparse, json
+from includes.engine import TICK_RATE
+from includes.replay import ReplayPlayer
+
+def drawBoard(engine):
+  """
+    The visible part of the board as text, the current tetromino is marked with @
+  """
+  current = set(engine.current.squares)
+  lines = []
+  for row in range(engine.board.height):
+    line = ''
+    for col in range(engine.board.width):
+      if (col, row) in current:
+        line += '@'
+      elif engine.board.isOccupied(col, row):
+        line += '#'
+      else:
+        line += '.'
+    lines.append('|' + line + '|')
+  return '\n'.join(lines)
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Play back a recorded game')
+  parser.add_argument('path')
+  parser.add_argument('--tick', type = int, help = 'show the board at this logic tick')
+  args = parser.parse_args()
+
+  try:
+    player = ReplayPlayer(args.path)
+    if args.tick is None:
+      engine = player.play()
+    else:
+      engine = player.seek(args.tick)
+      print(drawBoard(engine))
+  except ValueError as e:
+    parser.error(str(e))
+
+  print(json.dumps({
+    'seed': player.seed,
+    'score': engine.score,
+    'lines': engine.lines,
+    # Placed tetrominos: the falling one (or the one that topped out) is not counted
+    'pieces': engine.pieces - 1,
+    'time': engine.ticks / TICK_RATE,
+    'gameOver': engine.gameOver
+  }, indent = 2))
+  player.close()
+
+if __name__ == '__main__':
+  main()
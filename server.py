@@ -0,0 +1,58 @@
+# Multiplayer server running many games in one process (see includes/multiplayer.py)
+#   python server.py --port 7777
+#   python server.py --bench 200 --seconds 10
+import argparse, asyncio, json, sys
+from includes.multiplayer import GameServer, LocalClient
+
+async def keepPlaying(host, port, mode, seed):
+  """
+    A local client that joins a new game whenever its game is over
+  """
+  while True:
+    await LocalClient(mode, seed = seed).play(host, port)
+    seed += 1
+
+async def bench(args):
+  """
+    Fill the server with local clients and report how many sessions the tick loop sustains per
+    core (the cost of the tick only, see GameServer.stats)
+  """
+  server = GameServer(seed = args.seed)
+  port = await server.start('127.0.0.1', 0)
+  clients = [asyncio.create_task(keepPlaying('127.0.0.1', port, args.mode, args.seed + i))
+             for i in range(args.bench)]
+  for _ in range(int(args.seconds)):
+    await asyncio.sleep(1)
+    print(json.dumps(server.stats()), file = sys.stderr)
+  report = server.stats()
+  for client in clients:
+    client.cancel()
+  await asyncio.gather(*clients, return_exceptions = True)
+  await server.stop()
+  print(json.dumps(report, indent = 2))
+
+async def serve(args):
+  server = GameServer(seed = args.seed)
+  port = await server.start(args.host, args.port)
+  print('listening on %s:%d' % (args.host, port), file = sys.stderr)
+  while True:
+    await asyncio.sleep(args.stats)
+    print(json.dumps(server.stats()), file = sys.stderr)
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Host multiplayer tetris games')
+  parser.add_argument('--host', default = '127.0.0.1')
+  parser.add_argument('--port', type = int, default = 7777)
+  parser.add_argument('--seed', type = int, default = 0)
+  parser.add_argument('--stats', type = float, default = 10,
+    help = 'seconds between two load reports')
+  parser.add_argument('--bench', type = int, metavar = 'N',
+    help = 'run N local clients against the server instead of listening')
+  parser.add_argument('--mode', choices = ['versus', 'solo'], default = 'versus',
+    help = 'game mode of the benchmark clients')
+  parser.add_argument('--seconds', type = float, default = 10, help = 'length of the benchmark')
+  args = parser.parse_args()
+  asyncio.run(bench(args) if args.bench else serve(args))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,89 @@
+# Checks that the rules stay the same across the engines and that saved games resume exactly
+#   python -m pytest tests
+import random
+import pytest
+from includes.engine import Engine, ACTIONS
+
+def playRandom(engine, rng, steps):
+  for _ in range(steps):
+    engine.step(rng.choice(ACTIONS))
+
+def state(engine):
+  current = engine.current
+  return [bytes(engine.board.grid), engine.score, engine.lines, engine.pieces, engine.gameOver,
+          current.shape, current.color, current.squares, engine.next.shape, engine.next.col]
+
+def test_serialize_resumes_the_game():
+  for seed in range(20):
+    engine = Engine(seed)
+    playRandom(engine, random.Random(seed), 300)
+    copy = Engine()
+    copy.deserialize(engine.serialize())
+    assert state(copy) == state(engine)
+    for (e, rng) in ((engine, random.Random(-seed)), (copy, random.Random(-seed))):
+      playRandom(e, rng, 1000)
+    assert state(copy) == state(engine)
+
+def test_restore_replays_the_game():
+  engine = Engine(7)
+  playRandom(engine, random.Random(7), 300)
+  snapshot = engine.snapshot()
+  expected = state(engine)
+  playRandom(engine, random.Random(1), 1000)
+  after = state(engine)
+  engine.restore(snapshot)
+  assert state(engine) == expected
+  playRandom(engine, random.Random(1), 1000)
+  assert state(engine) == after
+
+def test_vecengine_matches_engine():
+  pytest.importorskip('numpy')
+  from includes.vecengine import VecEngine, ACTION_CODES
+
+  n = 50
+  vec = VecEngine(n, seed = 3)
+  engines = [Engine(int(seed)) for seed in vec.seeds]
+  # The engine keeps more hidden rows above the map than the vectorized one
+  skip = (engines[0].board.hidden - vec.hidden) * vec.width
+
+  rng = random.Random(0)
+  for _ in range(2000):
+    actions = [rng.choice(ACTIONS) for _ in range(n)]
+    for (engine, action) in zip(engines, actions):
+      engine.step(action)
+    vec.step([ACTION_CODES[action] for action in actions])
+    for (i, engine) in enumerate(engines):
+      assert bytes(engine.board.grid)[skip:] == vec.boards[i].tobytes()
+      assert [engine.score, engine.lines, engine.pieces, engine.gameOver] == \
+             [vec.score[i], vec.lines[i], vec.pieces[i], vec.gameOver[i]]
+      if not engine.gameOver:
+        assert engine.current.squares == [tuple(square) for square in vec.squares[i].tolist()]
+
+def test_vecengine_boards_are_independent():
+  np = pytest.importorskip('numpy')
+  from includes.vecengine import VecEngine
+
+  rng = np.random.default_rng(0)
+  games = [VecEngine(8, seed = 5) for _ in range(2)]
+  for _ in range(500):
+    actions = [rng.integers(7, size = 8) for _ in games]
+    # Only the other boards play differently
+    actions[1][0] = actions[0][0]
+    for (vec, a) in zip(games, actions):
+      vec.step(a)
+  assert games[0].boards[0].tobytes() == games[1].boards[0].tobytes()
+  assert games[0].pieces[0] == games[1].pieces[0]
+
+def test_vecengine_resets_finished_games():
+  np = pytest.importorskip('numpy')
+  from includes.vecengine import VecEngine
+
+  vec = VecEngine(16, seed = 1)
+  rng = np.random.default_rng(1)
+  while not vec.gameOver.any():
+    vec.step(rng.integers(7, size = 16))
+  over = vec.gameOver.copy()
+  vec.reset(vec.gameOver)
+  assert not vec.gameOver.any()
+  assert (vec.pieces[over] == 1).all() and (vec.games[over] == 2).all()
+  assert not vec.boards[over].any()
@@ -0,0 +1,105 @@
+# Play many headless games with automated players on every core and summarize the results
+#   python tournament.py --bot random --games 100000
+import argparse, json, random, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from includes.engine import Engine, TICK_RATE
+from includes.bots import loadBot
+
+def playGame(bot, seed, maxTicks, bag = False):
+  """
+    Play one game until it is over (or maxTicks logic ticks have passed)
+  """
+  engine = Engine(seed, bag = bag)
+  rng = random.Random(seed)
+  while not engine.gameOver and engine.ticks < maxTicks:
+    action = bot(engine, rng)
+    if action:
+      engine.step(action)
+    gravity = engine.tick()
+    if gravity:
+      engine.step(gravity)
+
+  return {
+    'seed': seed,
+    'score': engine.score,
+    'lines': engine.lines,
+    # Placed tetrominos: the falling one (or the one that topped out) is not counted
+    'pieces': engine.pieces - 1,
+    'time': engine.ticks / TICK_RATE,
+    'toppedOut': engine.gameOver
+  }
+
+def playShard(botName, seeds, maxTicks, bag):
+  """
+    Runs in a worker process: play a game for every seed of the shard
+  """
+  bot = loadBot(botName)
+  return [playGame(bot, seed, maxTicks, bag) for seed in seeds]
+
+class Summary:
+  """
+    Aggregates the results of the games as they arrive
+  """
+  keys = ['score', 'lines', 'pieces', 'time']
+
+  def __init__(self):
+    self.games = 0
+    self.toppedOut = 0
+    self.totals = {k: 0 for k in Summary.keys}
+    self.best = {k: 0 for k in Summary.keys}
+
+  def add(self, result):
+    self.games += 1
+    self.toppedOut += result['toppedOut']
+    for k in Summary.keys:
+      self.totals[k] += result[k]
+      self.best[k] = max(self.best[k], result[k])
+
+  def report(self):
+    return {
+      'games': self.games,
+      'toppedOut': self.toppedOut,
+      'mean': {k: self.totals[k] / max(self.games, 1) for k in Summary.keys},
+      'max': self.best
+    }
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Run a tournament of headless tetris games')
+  parser.add_argument('--bot', default = 'random',
+    help = 'name of a built-in bot or package.module:function')
+  parser.add_argument('--games', type = int, default = 1000)
+  parser.add_argument('--seed', type = int, default = 0, help = 'seed of the first game')
+  parser.add_argument('--workers', type = int, default = None, help = 'defaults to every core')
+  parser.add_argument('--shard', type = int, default = 100, help = 'games per task')
+  parser.add_argument('--max-time', type = float, default = 3600,
+    help = 'stop a game after this many seconds of game time')
+  parser.add_argument('--bag', action = 'store_true', help = 'deal the shapes in bags of seven')
+  parser.add_argument('--results', help = 'write the result of every game to this JSONL file')
+  args = parser.parse_args()
+
+  # Fail early on an unknown bot instead of in every worker
+  loadBot(args.bot)
+  maxTicks = int(args.max_time * TICK_RATE)
+  seeds = range(args.seed, args.seed + args.games)
+  shards = [seeds[i:i + args.shard] for i in range(0, len(seeds), args.shard)]
+
+  summary = Summary()
+  output = open(args.results, 'w') if args.results else None
+  start = time.monotonic()
+  with ProcessPoolExecutor(max_workers = args.workers) as pool:
+    tasks = [pool.submit(playShard, args.bot, list(shard), maxTicks, args.bag) for shard in shards]
+    for task in as_completed(tasks):
+      for result in task.result():
+        summary.add(result)
+        if output:
+          output.write(json.dumps(result) + '\n')
+      elapsed = time.monotonic() - start
+      print('%d/%d games, %.0f games/s' % (summary.games, args.games, summary.games / elapsed),
+        file = sys.stderr)
+
+  if output:
+    output.close()
+  print(json.dumps(summary.report(), indent = 2))
+
+if __name__ == '__main__':
+  main()